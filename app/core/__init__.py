@@ -10,6 +10,7 @@ from flask_jwt_extended import jwt_required, current_user
 from ..project import redis_client, db
 from .common import check_if_import_status, check_if_execution_status, get_execution_key, create_status_object, \
     save_import_status, save_execution_status, get_unassigned_addresses, is_address_assigned
+from .engine.engines import VRP_ENGINES, TSP_ENGINES
 from .tasks import TaskStatus, add_new_address, read_import_data, prepare_and_run_VRP, prepare_and_run_TSP, \
     unassigned_address_w_coords_exists
 from ..project.flask_crud_extension import register_crud_routes, CRUDView, CRUDError
@@ -67,10 +68,28 @@ def start_algorithm():
     depot_addr_id = request.args.get('depot_addr_id', current_user.depot_addr_id, int)
     if not depot_addr_id:
         return jsonify({'msg': "No valid depot address ID provided - can be either a query parameter 'depot_addr_id', or can be set on the user level"}), 400
+    # Optional anytime limits: a time budget in seconds and/or a number of GA generations (segments of ALNS iterations,
+    # tabu iterations for TSP) without improvement, after which the best solution found so far is used
+    time_budget = request.args.get('time_budget', None, float)
+    max_stall = request.args.get('max_stall', None, int)
+    if time_budget is not None and not time_budget > 0:
+        return jsonify({'msg': "Query parameter 'time_budget' has to be a positive number of seconds"}), 400
+    if max_stall is not None and max_stall <= 0:
+        return jsonify({'msg': "Query parameter 'max_stall' has to be a positive number"}), 400
+    # Cluster-first, route-second solving is picked automatically for large imports, 'decompose' forces it on or off
+    decompose = get_bool_request_arg(request, 'decompose', is_switch=True)
     if get_bool_request_arg(request, 'use_tsp'):
-        prepare_and_run_TSP.delay(current_user.id, depot_addr_id)
+        tsp_engine = request.args.get('tsp_engine', 'tabu')
+        if tsp_engine not in TSP_ENGINES:
+            return jsonify({'msg': f"Unknown TSP engine '{tsp_engine}', can be one of: {', '.join(TSP_ENGINES)}"}), 400
+        prepare_and_run_TSP.delay(current_user.id, depot_addr_id, time_budget, max_stall, tsp_engine)
     else:
-        prepare_and_run_VRP.delay(current_user.id, depot_addr_id, current_user.max_capacity)
+        engine = request.args.get('engine', 'ga')
+        if engine not in VRP_ENGINES:
+            return jsonify({'msg': f"Unknown VRP engine '{engine}', can be one of: {', '.join(VRP_ENGINES)}"}), 400
+        prepare_and_run_VRP.delay(current_user.id, depot_addr_id, current_user.max_capacity,
+                                  request.args.get('distributed_jobs', None, int), time_budget, max_stall, decompose,
+                                  get_bool_request_arg(request, 'warm_start'), engine)
     save_execution_status(current_user.id, TaskStatus.IN_PROGRESS)
     return {'msg': "Algorithm execution has begun, please periodically query /get-execution-state to check the status"}
 
@@ -7,6 +7,8 @@ from ..project import redis_client, db
 
 get_import_key = lambda user_id: f'import-{user_id}'
 get_execution_key = lambda user_id: f'execution-{user_id}'
+get_execution_jobs_key = lambda user_id: f'execution-jobs-{user_id}'
+get_solution_key = lambda user_id: f'solution-{user_id}'
 
 def create_status_object(status, data=None):
     return {'status': status.value, 'data': data}
@@ -20,6 +22,20 @@ def save_import_status(user_id, status, data=None):
 def save_execution_status(user_id, status, data=None):
     _save_status(get_execution_key(user_id), status, data)
 
+def count_finished_execution_job(user_id):
+    return redis_client.incr(get_execution_jobs_key(user_id))
+
+def reset_execution_jobs(user_id):
+    redis_client.delete(get_execution_jobs_key(user_id))
+
+def save_last_solution(user_id, depot_addr_id, max_capacity, routes):
+    # Routes as lists of address IDs without the depot, for warm starting the next solve
+    redis_client.set(get_solution_key(user_id), json.dumps({'depot_addr_id': depot_addr_id, 'max_capacity': max_capacity, 'routes': routes}))
+
+def get_last_solution(user_id):
+    solution = redis_client.get(get_solution_key(user_id))
+    return json.loads(solution) if solution else None
+
 def _check_if_status(key, status):
     result_str = redis_client.get(key)
     if not result_str:
@@ -0,0 +1,60 @@
+import numpy as np
+
+from .matrix import METRICS, convert_coords
+from .spatial import GridIndex
+
+# Co-located stops (several deliveries to the same building) are solved as a single node: stops within the radius of
+# another one are grouped with it into a super-node with their summed capacity, as long as it stays within the vehicle
+# capacity. Routes of the reduced instance are then expanded back to the individual stops
+
+def aggregate_stops(coords, nodes, max_capacity, radius, metric='haversine'):
+    # Coordinates, nodes and groups (original node indices per node, the depot's group last) of the reduced instance,
+    # laid out as prepare_nodes returns them. The radius is in metres (coordinate units for the euclidean metric) and
+    # is measured from the first stop of a group, stops are only grouped within their grid cell's neighbourhood. Groups
+    # are None when no stops were merged, or when fewer than two nodes would be left to route
+    n = len(nodes) - 1
+    if not radius or n < 2:
+        return coords, nodes, None
+    index = GridIndex(coords[:-1], metric)
+    r = radius / 1000 if metric == 'haversine' else radius
+    demands = [int(node[1]) for node in nodes[:-1]]
+    grouped = np.zeros(n, dtype=bool)
+    groups = []
+    for seed in range(n):
+        if grouped[seed]:
+            continue
+        grouped[seed] = True
+        group, load = [seed], demands[seed]
+        near = index.radius(seed, r)
+        for c in near[np.argsort(np.hypot(*(index.points[near] - index.points[seed]).T), kind='stable')].tolist():
+            if not grouped[c] and load + demands[c] <= max_capacity:
+                grouped[c] = True
+                group.append(c)
+                load += demands[c]
+        groups.append(group)
+    if len(groups) == n or len(groups) < 2:
+        return coords, nodes, None
+
+    # A super-node is located at the centre of its stops and takes the address id and address of the first one
+    reduced_coords = np.array([coords[group].mean(axis=0) for group in groups] + [coords[-1]])
+    reduced_nodes = [(nodes[group[0]][0], sum(demands[c] for c in group), nodes[group[0]][2]) for group in groups]
+    reduced_nodes.append(nodes[-1])
+    groups.append([n])
+    print(f'Aggregated {n} stops into {len(groups) - 1} nodes (radius {radius})')
+    return reduced_coords, reduced_nodes, groups
+
+def expand_routes(routes, groups, coords, metric='haversine'):
+    # Routes of the reduced instance (node index lists with the depot at both ends) as routes over the original nodes,
+    # the stops of a super-node visited in nearest neighbour order from the stop before it
+    points = convert_coords(coords, metric)
+    distance = METRICS[metric][1]
+    expanded = []
+    for route in routes:
+        stops = [groups[route[0]][0]]
+        for node in route[1:-1]:
+            members = list(groups[node])
+            while members:
+                stops.append(members.pop(int(np.argmin(distance(points[stops[-1]], points[members])))))
+        stops.append(groups[route[-1]][0])
+        expanded.append(stops)
+    return expanded
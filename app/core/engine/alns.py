@@ -0,0 +1,242 @@
+import math
+import random
+from multiprocessing import get_context
+from time import time
+
+import numpy as np
+
+from .common import get_depot_and_genes
+from .construction import savings_tour
+from .local_search import EPS, NEIGHBOURS, LocalSearch
+from .matrix import tolerance
+from .parallel import can_start_processes
+from .spatial import GridIndex
+from .split import split_tour
+
+# Parameters of a single ALNS run by ALNS.start
+ALNS_PARAMS = {'iterations': 5000}
+# Customers removed per iteration, a random share of them between these bounds but never more than MAX_REMOVED
+REMOVAL_RATIO = (0.05, 0.25)
+MAX_REMOVED = 60
+# Scores an operator pair gets for a new best solution, for an improvement of the current one and for an accepted
+# worse one. Operator weights are updated from the average scores of every segment of that many iterations
+SCORES = (33, 9, 13)
+SEGMENT = 100
+REACTION = 0.1
+# Simulated annealing acceptance: a solution START_WORSE worse than the initial one is accepted with probability 0.5
+# at the start, the temperature cooling geometrically to END_TEMPERATURE of that over the iterations
+START_WORSE = 0.01
+END_TEMPERATURE = 0.01
+# Randomization of worst and related removal, higher values stick closer to the worst and the most related customers
+WORST_RANDOMNESS = 3
+RELATED_RANDOMNESS = 6
+
+_engine = None
+
+def _init_worker(engine):
+    global _engine
+    _engine = engine
+
+def _run(job):
+    seed, iterations, time_limit, max_stall = job
+    _engine.seed = seed
+    _engine.random = random.Random(seed)
+    return _engine.solve(iterations, time_limit, max_stall)
+
+class ALNS:
+    # Adaptive Large Neighbourhood Search: every iteration a destroy operator (random, worst or related removal) takes a
+    # part of the customers out of the current solution and a repair operator (greedy or regret-2 insertion) puts them
+    # back, the result being accepted by simulated annealing. Operators are picked by roulette wheel over weights
+    # adapted to how well they did in the previous segments, and every new best solution is finished by inter-route
+    # local search. Solutions are lists of routes (customer node indices without the depot)
+    def __init__(self, max_capacity, matrix, nodes, workers=1, seed=None, coords=None):
+        self.max_capacity = max_capacity
+        self.matrix = matrix
+        self.nodes = nodes
+        depot, genes = get_depot_and_genes(nodes)
+        self.depot = depot[0]
+        self.customers = np.arange(len(genes))
+        self.demands = np.array([gen[1] for gen in genes] + [0])
+        self.eps = tolerance(matrix, EPS)
+        self.candidates = GridIndex(coords).knn(NEIGHBOURS, exclude=self.depot)[:len(genes)] if coords is not None else None
+        self.local_search = LocalSearch(matrix, self.demands, self.depot, max_capacity, candidates=self.candidates)
+        # Taken for the engine interface only, there are no route optimizations to spread over workers
+        self.workers = workers
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)
+        self.destroy_operators = [self.random_removal, self.worst_removal, self.related_removal]
+        self.repair_operators = [self.greedy_insertion, self.regret_insertion]
+        self.stats = {}
+
+    def cost(self, routes):
+        stops = np.array([self.depot] + [c for route in routes for c in route + [self.depot]])
+        return float(self.matrix[stops[:-1], stops[1:]].sum())
+
+    def initial_solution(self):
+        # Savings tour split optimally into routes
+        tour = savings_tour(self.matrix, self.depot, self.demands, self.max_capacity, self.customers, candidates=self.candidates)
+        bounds, _ = split_tour(tour, self.demands, self.matrix, self.depot, self.max_capacity)
+        return [tour[a:b].tolist() for a, b in bounds]
+
+    def _pick(self, count, randomness):
+        # Rank among count candidates sorted by preference, biased towards the first ones
+        return int(self.random.random() ** randomness * count)
+
+    def random_removal(self, routes, q):
+        return self.random.sample([c for route in routes for c in route], q)
+
+    def worst_removal(self, routes, q):
+        # Customers saving the most distance when taken out, the savings computed once for the iteration
+        stops = np.array([c for route in routes for c in route])
+        prevs = np.array([self.depot if i == 0 else route[i - 1] for route in routes for i in range(len(route))])
+        nexts = np.array([route[i + 1] if i + 1 < len(route) else self.depot for route in routes for i in range(len(route))])
+        gains = self.matrix[prevs, stops] + self.matrix[stops, nexts] - self.matrix[prevs, nexts]
+        order = stops[np.argsort(-gains, kind='stable')].tolist()
+        return [order.pop(self._pick(len(order), WORST_RANDOMNESS)) for _ in range(q)]
+
+    def related_removal(self, routes, q):
+        # Shaw removal by distance: customers close to one already removed, starting from a random one
+        remaining = np.array([c for route in routes for c in route])
+        seed = self.random.randrange(len(remaining))
+        removed = [int(remaining[seed])]
+        remaining = np.delete(remaining, seed)
+        while len(removed) < q:
+            distances = self.matrix[self.random.choice(removed), remaining]
+            i = int(np.argsort(distances, kind='stable')[self._pick(len(remaining), RELATED_RANDOMNESS)])
+            removed.append(int(remaining[i]))
+            remaining = np.delete(remaining, i)
+        return removed
+
+    def greedy_insertion(self, routes, customers):
+        self._insert(routes, customers, regret=False)
+
+    def regret_insertion(self, routes, customers):
+        self._insert(routes, customers, regret=True)
+
+    def _insert(self, routes, customers, regret):
+        # Inserts the customers one at a time: with greedy insertion the one that is cheapest to insert, with regret
+        # insertion the one losing the most if not inserted into its best route now. Insertion costs into every position
+        # of a route are kept as a (customers x positions) block, the last row of the per-route minima being a route of
+        # its own, so only the block of the route changed by an insertion is recomputed
+        customers = np.array(customers)
+        demands = self.demands[customers]
+        loads = [int(self.demands[route].sum()) for route in routes]
+        blocks = [None] * len(routes)
+        best = np.empty((len(routes) + 1, len(customers)))
+        best[-1] = 2 * self.matrix[self.depot, customers]
+
+        def update(r):
+            stops = np.array([self.depot] + routes[r] + [self.depot])
+            costs = self.matrix[np.ix_(customers, stops[:-1])] + self.matrix[np.ix_(customers, stops[1:])] - \
+                self.matrix[stops[:-1], stops[1:]]
+            costs[loads[r] + demands > self.max_capacity] = np.inf
+            blocks[r] = costs
+            best[r] = costs.min(axis=1)
+
+        for r in range(len(routes)):
+            update(r)
+        pending = np.ones(len(customers), dtype=bool)
+        for _ in range(len(customers)):
+            if regret and len(best) > 1:
+                first, second = np.partition(best, 1, axis=0)[:2]
+                score = np.where(pending, second - first, -np.inf)
+                i = int(np.argmax(score))
+            else:
+                i = int(np.argmin(np.where(pending, best.min(axis=0), np.inf)))
+            r = int(best[:, i].argmin())
+            c = int(customers[i])
+            if r == len(routes):
+                routes.append([c])
+                loads.append(int(demands[i]))
+                blocks.append(None)
+                best = np.vstack((best[:-1], np.empty(len(customers)), best[-1:]))
+            else:
+                routes[r].insert(int(blocks[r][i].argmin()), c)
+                loads[r] += int(demands[i])
+            update(r)
+            pending[i] = False
+
+    def _roulette(self, weights):
+        return self.random.choices(range(len(weights)), weights)[0]
+
+    def solve(self, iterations=ALNS_PARAMS['iterations'], time_limit=None, max_stall=None):
+        # Returns the best routes found and their cost. max_stall counts segments without a new best solution
+        started = time()
+        self.stats = {'iterations': 0, 'best_found': 0, 'accepted': 0, 'history': []}
+        n = len(self.customers)
+        low, high = max(1, round(n * REMOVAL_RATIO[0])), max(1, min(round(n * REMOVAL_RATIO[1]), MAX_REMOVED, n))
+        current, current_cost = self.local_search.improve(self.initial_solution())
+        best, best_cost = current, current_cost
+        self.stats['history'].append(best_cost)
+        temperature = -START_WORSE * current_cost / math.log(0.5)
+        cooling = END_TEMPERATURE ** (1 / iterations)
+        weights = [[1.] * len(self.destroy_operators), [1.] * len(self.repair_operators)]
+        scores = [[0.] * len(self.destroy_operators), [0.] * len(self.repair_operators)]
+        uses = [[0] * len(self.destroy_operators), [0] * len(self.repair_operators)]
+        stall = 0
+
+        for iteration in range(iterations):
+            d, r = self._roulette(weights[0]), self._roulette(weights[1])
+            routes = [list(route) for route in current]
+            removed = self.destroy_operators[d](routes, self.random.randint(low, high))
+            taken = set(removed)
+            routes = [route for route in ([c for c in route if c not in taken] for route in routes) if route]
+            self.repair_operators[r](routes, removed)
+            cost = self.cost(routes)
+
+            score = 0
+            if cost < best_cost - self.eps:
+                routes, cost = self.local_search.improve(routes)
+                best, best_cost = routes, cost
+                current, current_cost = routes, cost
+                score = SCORES[0]
+                stall = 0
+                self.stats['best_found'] += 1
+                self.stats['history'].append(best_cost)
+            elif cost < current_cost - self.eps:
+                current, current_cost = routes, cost
+                score = SCORES[1]
+            elif self.random.random() < math.exp((current_cost - cost) / temperature):
+                current, current_cost = routes, cost
+                score = SCORES[2]
+            self.stats['accepted'] += score > 0
+            for operator, ops in ((d, 0), (r, 1)):
+                scores[ops][operator] += score
+                uses[ops][operator] += 1
+            temperature *= cooling
+            self.stats['iterations'] = iteration + 1
+
+            if (iteration + 1) % SEGMENT == 0:
+                for ops in range(2):
+                    weights[ops] = [w * (1 - REACTION) + REACTION * s / u if u else w
+                                    for w, s, u in zip(weights[ops], scores[ops], uses[ops])]
+                    scores[ops] = [0.] * len(scores[ops])
+                    uses[ops] = [0] * len(uses[ops])
+                stall += 1
+                if max_stall and stall >= max_stall:
+                    break
+            if time_limit and time() - started >= time_limit:
+                break
+
+        self.stats['weights'] = weights
+        print(f'''ALNS: cost {self.stats['history'][0]:.2f} -> {best_cost:.2f} in {self.stats['iterations']} iterations '''
+              f'''({self.stats['best_found']} new best, {self.stats['accepted']} accepted), total time: {time() - started:.2f} secs.''')
+        return best, best_cost
+
+    def start(self, k, islands=True, time_limit=None, max_stall=None, params=None):
+        # Runs k searches from different seeds, with islands at the same time in separate processes (without migration)
+        # or one after another sharing the time limit (also when this process can't start others), and returns the best
+        # routes as CVRP.start does
+        params = dict(ALNS_PARAMS, **(params or {}))
+        parallel = islands and k > 1 and can_start_processes()
+        jobs = [(self.seed + i, params['iterations'], time_limit if parallel else time_limit and time_limit / k, max_stall)
+                for i in range(k)]
+        if parallel:
+            with get_context().Pool(k, initializer=_init_worker, initargs=(self,)) as pool:
+                results = pool.map(_run, jobs, chunksize=1)
+        else:
+            _init_worker(self)
+            results = [_run(job) for job in jobs]
+        routes, cost = min(results, key=lambda result: result[1])
+        print(f'Best ALNS result: {cost:.2f}')
+        return [[self.depot] + route + [self.depot] for route in routes]
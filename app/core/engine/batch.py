@@ -0,0 +1,86 @@
+import numpy as np
+
+class BatchEvaluator:
+    # Scores a whole population of giant tours (a 2-D integer array of customer node indices, one permutation per row)
+    # with array operations over all rows at once: gathered edge lengths and cumulative sums of distances and demands
+    # replace the per-chromosome Python loops, so thousands of tours cost a few NumPy calls per tour position
+    def __init__(self, matrix, demands, depot, max_capacity):
+        self.matrix = matrix
+        self.demands = np.asarray(demands)
+        self.depot = depot
+        self.max_capacity = max_capacity
+        # No route can be longer than the number of smallest demands fitting together, which bounds the split window
+        fitting = np.cumsum(np.sort(self.demands[np.arange(len(self.demands)) != depot])) <= max_capacity
+        self.window = max(int(fitting.sum()), 1)
+
+    def tour_costs(self, population):
+        # Cost of every row as a single route from the depot through all its customers and back
+        population = np.asarray(population)
+        return self.matrix[self.depot, population[:, 0]] + self.matrix[population[:, :-1], population[:, 1:]].sum(axis=1) + \
+            self.matrix[population[:, -1], self.depot]
+
+    def split(self, population):
+        # Prins' split of every row at once: the shortest path over route arcs (i, j), pulled for each end position j
+        # from the window of start positions a route ending there can have. Arc costs come from prefix sums of the
+        # edge lengths and loads, so each position is one (population x window) array operation. Returns the total
+        # costs and a boolean (population x n) mask of the positions starting a route
+        population = np.asarray(population)
+        size, n = population.shape
+        rows = np.arange(size)
+        depot_dist = np.asarray(self.matrix[self.depot, population], dtype=np.float64)
+        edges = np.zeros((size, n))
+        edges[:, 1:] = np.cumsum(self.matrix[population[:, :-1], population[:, 1:]], axis=1)
+        loads = np.zeros((size, n + 1), dtype=np.int64)
+        loads[:, 1:] = np.cumsum(self.demands[population], axis=1)
+
+        cost = np.full((size, n + 1), np.inf)
+        cost[:, 0] = 0
+        pred = np.zeros((size, n + 1), dtype=np.int64)
+        for j in range(n):
+            starts = np.arange(max(0, j - self.window + 1), j + 1)
+            total = cost[:, starts] + depot_dist[:, starts] + (edges[:, j, None] - edges[:, starts]) + depot_dist[:, j, None]
+            # A route of a single customer is always allowed, as in split_tour
+            total[(loads[:, j + 1, None] - loads[:, starts] > self.max_capacity) & (starts < j)] = np.inf
+            best = total.argmin(axis=1)
+            cost[:, j + 1] = total[rows, best]
+            pred[:, j + 1] = starts[best]
+
+        # Route starts are followed back from the end of every row together, one route per step
+        route_starts = np.zeros((size, n), dtype=bool)
+        j = np.full(size, n)
+        while (j > 0).any():
+            active = j > 0
+            j[active] = pred[rows[active], j[active]]
+            route_starts[rows[active], j[active]] = True
+        return cost[:, n], route_starts
+
+    def route_loads(self, population, route_starts):
+        # (population x n) array whose k-th column is the load of every row's k-th route, zero past its last one
+        route = np.cumsum(route_starts, axis=1) - 1
+        loads = np.zeros(route_starts.shape, dtype=np.int64)
+        np.add.at(loads, (np.arange(len(route))[:, None], route), self.demands[np.asarray(population)])
+        return loads
+
+    def evaluate(self, population):
+        # Total costs, route start masks and route loads of a whole population
+        costs, route_starts = self.split(population)
+        return costs, route_starts, self.route_loads(population, route_starts)
+
+def route_bounds(route_starts):
+    # (start, end) slices of the routes of one row of a route start mask
+    starts = np.flatnonzero(route_starts).tolist()
+    return list(zip(starts, starts[1:] + [len(route_starts)]))
+
+def broken_pairs_diversity(population):
+    # Mean broken-pairs distance over all pairs of rows: the share of customers whose successor in the giant tour (the
+    # end of the tour counting as one) differs between the two. Pairs sharing a successor are counted per customer
+    # from how many rows agree on it, so it's O(population * n) instead of comparing every pair of rows
+    population = np.asarray(population)
+    size, n = population.shape
+    if size < 2:
+        return 0.
+    successors = np.full((size, n), n, dtype=np.int64)
+    np.put_along_axis(successors, population[:, :-1], population[:, 1:], axis=1)
+    _, counts = np.unique((np.arange(n) * (n + 1) + successors).ravel(), return_counts=True)
+    shared = (counts * (counts - 1) // 2).sum()
+    return 1 - shared / (size * (size - 1) // 2 * n)
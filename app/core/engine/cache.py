@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from hashlib import blake2b
+
+import numpy as np
+
+from .matrix import CondensedMatrix, SparseMatrix
+
+ROUTE_CACHE_SIZE = 20000
+
+def matrix_fingerprint(matrix):
+    # Condensed matrices are hashed through their stored triangle, sparse ones through the coordinates they compute from
+    if isinstance(matrix, SparseMatrix):
+        return blake2b(matrix.metric.encode() + matrix.coords.tobytes(), digest_size=16).hexdigest()
+    values = matrix.values if isinstance(matrix, CondensedMatrix) else matrix
+    return blake2b(np.ascontiguousarray(values).view(np.uint8), digest_size=16).hexdigest()
+
+class RouteCache:
+    # LRU mapping of a route's customer set to its optimized visiting order and cost
+    def __init__(self, max_size=ROUTE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.matrix_key = None
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, matrix):
+        # Orders and costs are only valid for the matrix they were computed on
+        matrix_key = matrix_fingerprint(matrix)
+        if matrix_key != self.matrix_key:
+            self.clear()
+            self.matrix_key = matrix_key
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,13 +1,18 @@
 import numpy as np
 
 from ..common import get_unassigned_addresses
+from .matrix import MATRIX_MEMORY_LIMIT, build_matrix, choose_storage
+
+# Storages kept in the per-user matrix cache, with their dtypes
+CACHED_STORAGES = {'dense': np.float64, 'float32': np.float32}
 
 def get_depot_and_genes(nodes):
     depot = (len(nodes) - 1, 0)
     genes = [(i, int(nodes[i][1])) for i in range(len(nodes) - 1)]
     return depot, genes
 
-def prepare_w_matrix(user_id, depot_addr_id):
+def prepare_nodes(user_id, depot_addr_id):
+    # Coordinates and nodes of the unassigned addresses, the depot last
     addresses = get_unassigned_addresses(user_id).all()
     if len(addresses) < 3:
         raise Exception("Not enough available addresses")
@@ -28,9 +33,18 @@ def prepare_w_matrix(user_id, depot_addr_id):
         raise Exception("Depot not found among unassigned addresses")
     nodes.append(depot_node)
     coords = np.concatenate((coords, [depot_coords]))
-    matrix = np.empty((len(nodes), len(nodes)))
-    for i in range(len(nodes)):
-        for j in range(i, len(nodes)):
-            matrix[i][j] = np.linalg.norm(coords[i] - coords[j])
-            matrix[j][i] = matrix[i][j]
+    return coords, nodes
+
+def get_w_matrix(user_id, coords, nodes, metric='haversine', storage='auto', memory_limit=MATRIX_MEMORY_LIMIT, cache=None):
+    # With the 'auto' storage the most precise one whose estimated size fits in memory_limit bytes is used. Dense
+    # matrices are taken from the user's entry in the matrix cache when one is given, and updated there
+    if storage == 'auto':
+        storage = choose_storage(len(coords), memory_limit)
+    if cache is not None and storage in CACHED_STORAGES:
+        return cache.get(f'matrix-{user_id}', [node[0] for node in nodes], coords, metric, CACHED_STORAGES[storage])
+    return build_matrix(coords, metric, storage)
+
+def prepare_w_matrix(user_id, depot_addr_id, metric='haversine', storage='auto', memory_limit=MATRIX_MEMORY_LIMIT, cache=None):
+    coords, nodes = prepare_nodes(user_id, depot_addr_id)
+    matrix = get_w_matrix(user_id, coords, nodes, metric, storage, memory_limit, cache)
     return coords, matrix, nodes
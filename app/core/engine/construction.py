@@ -0,0 +1,127 @@
+import numpy as np
+
+SAVINGS_NEIGHBOURS = 30
+
+# Constructive heuristics producing giant tours (customer node indices, without the depot) for seeding the GA. Route
+# boundaries are not kept, since the split decoder finds the best ones for the resulting order anyway
+
+def nearest_neighbour_tour(matrix, depot, demands, max_capacity, customers, rng=None, candidates=1):
+    # Goes to the nearest unvisited customer that still fits, or back to the depot when none does. With a generator and
+    # more candidates, a random one among that many nearest is taken instead, for diverse variants
+    unvisited = np.zeros(len(demands), dtype=bool)
+    unvisited[customers] = True
+    tour = []
+    current = depot
+    load = 0
+    for _ in range(len(customers)):
+        fits = unvisited & (load + demands <= max_capacity)
+        if not fits.any():
+            current, load = depot, 0
+            fits = unvisited
+        options = np.flatnonzero(fits)
+        distances = matrix[current, options]
+        if rng is not None and candidates > 1 and len(options) > 1:
+            nearest = np.argpartition(distances, min(candidates, len(options)) - 1)[:candidates]
+            current = options[rng.choice(nearest)]
+        else:
+            current = options[np.argmin(distances)]
+        unvisited[current] = False
+        load += demands[current]
+        tour.append(current)
+    return np.array(tour)
+
+def savings_tour(matrix, depot, demands, max_capacity, customers, neighbours=SAVINGS_NEIGHBOURS, candidates=None):
+    # Clarke-Wright parallel savings, considering only merges between each customer and its nearest neighbours, taken
+    # from the candidates (nearest node indices per node, e.g. from the spatial index) when given
+    n = len(customers)
+    if candidates is None:
+        distances = matrix[np.ix_(customers, customers)].astype(np.float64)
+        np.fill_diagonal(distances, np.inf)
+        k = min(neighbours, n - 1)
+        near = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        lookup = np.full(len(demands), -1)
+        lookup[customers] = np.arange(n)
+        near = lookup[candidates[customers]]
+    a = np.repeat(np.arange(n), near.shape[1])
+    b = near.ravel()
+    valid = (b >= 0) & (a != b)
+    pairs = np.unique(np.minimum(a, b)[valid] * n + np.maximum(a, b)[valid])
+    a, b = pairs // n, pairs % n
+    depot_distances = matrix[depot, customers]
+    savings = depot_distances[a] + depot_distances[b] - matrix[customers[a], customers[b]]
+    order = np.argsort(-savings, kind='stable')
+
+    routes = {i: [i] for i in range(n)}
+    route_of = list(range(n))
+    load = demands[customers].tolist()
+    for i, j in zip(a[order].tolist(), b[order].tolist()):
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj or load[ri] + load[rj] > max_capacity:
+            continue
+        route_i, route_j = routes[ri], routes[rj]
+        # Both customers have to be route endpoints, the routes are joined through the i - j edge
+        if route_i[-1] == i and route_j[0] == j:
+            merged = route_i + route_j
+        elif route_i[0] == i and route_j[-1] == j:
+            merged = route_j + route_i
+        elif route_i[-1] == i and route_j[-1] == j:
+            merged = route_i + route_j[::-1]
+        elif route_i[0] == i and route_j[0] == j:
+            merged = route_i[::-1] + route_j
+        else:
+            continue
+        if len(route_i) < len(route_j):
+            ri, rj, route_j = rj, ri, route_i
+        routes[ri] = merged
+        load[ri] += load[rj]
+        del routes[rj]
+        for c in route_j:
+            route_of[c] = ri
+    return customers[np.concatenate(list(routes.values()))]
+
+def sweep_tour(coords, depot, customers, offset=0.):
+    # Customers ordered by polar angle around the depot, starting at the given angle
+    relative = coords[customers] - coords[depot]
+    angles = np.arctan2(relative[:, 0], relative[:, 1] * np.cos(np.radians(coords[depot][0])))
+    return customers[np.argsort((angles - offset) % (2 * np.pi), kind='stable')]
+
+def construct_tours(matrix, depot, demands, max_capacity, customers, count, coords=None, rng=None, candidates=None):
+    # Savings, nearest neighbour and sweep tours, followed by randomized nearest neighbour and rotated sweep variants
+    if not count:
+        return []
+    rng = rng or np.random.default_rng()
+    tours = [savings_tour(matrix, depot, demands, max_capacity, customers, candidates=candidates),
+             nearest_neighbour_tour(matrix, depot, demands, max_capacity, customers)]
+    if coords is not None:
+        tours.append(sweep_tour(coords, depot, customers))
+    while len(tours) < count:
+        if coords is not None and len(tours) % 2:
+            tours.append(sweep_tour(coords, depot, customers, rng.uniform(0, 2 * np.pi)))
+        else:
+            tours.append(nearest_neighbour_tour(matrix, depot, demands, max_capacity, customers, rng, 3))
+    return tours[:count]
+
+def cheapest_insertion(matrix, depot, demands, max_capacity, routes, customers):
+    # Inserts the customers into the routes (lists of customers without the depot) one at a time, farthest from the
+    # depot first, each at the position of the route with room for it where it adds the least distance. A customer
+    # that fits nowhere gets a route of its own
+    routes = [list(route) for route in routes]
+    loads = [int(demands[route].sum()) for route in routes]
+    for c in sorted(customers, key=lambda c: -matrix[depot, c]):
+        best, best_route, best_position = np.inf, None, None
+        for r, route in enumerate(routes):
+            if loads[r] + demands[c] > max_capacity:
+                continue
+            stops = np.array([depot] + route + [depot])
+            costs = matrix[stops[:-1], c] + matrix[c, stops[1:]] - matrix[stops[:-1], stops[1:]]
+            position = int(np.argmin(costs))
+            if costs[position] < best:
+                best, best_route, best_position = costs[position], r, position
+        if best_route is None:
+            routes.append([c])
+            loads.append(int(demands[c]))
+        else:
+            routes[best_route].insert(best_position, c)
+            loads[best_route] += int(demands[c])
+    return routes
@@ -1,11 +1,35 @@
 import random
+from contextlib import contextmanager
 from time import time
 import numpy as np
 
+from .batch import BatchEvaluator, broken_pairs_diversity, route_bounds
+from .cache import RouteCache
 from .common import get_depot_and_genes
+from .local_search import EPS, NEIGHBOURS, LocalSearch
+from .construction import SAVINGS_NEIGHBOURS, cheapest_insertion, construct_tours
+from .exact import EXACT_ROUTE_SIZE, optimize_route
+from .islands import run_islands
+from .parallel import can_start_processes, route_pool
+from .spatial import GridIndex
+from .split import split_tour
 from .tabu import Tabu
 
 
+# Parameters of a single GA instance run by CVRP.start
+GA_PARAMS = {'k': 2, 'opt': min, 'ngen': 200, 'size': 100, 'ratio_cross': 0.85}
+# Tabu search iterations of a route optimization
+TABU_ITERATIONS = 5
+# Upper bound on the route optimization and local search rounds of a warm start
+WARM_ROUNDS = 10
+# Broken-pairs diversity below which a generation gets random immigrants in place of its worst individuals and its
+# offspring are mutated at least with ADAPTIVE_MUTATION probability
+DIVERSITY_THRESHOLD = 0.1
+IMMIGRANT_RATIO = 0.1
+ADAPTIVE_MUTATION = 0.2
+# Mutation attempts at making a duplicate unique before it is left as it is
+DUPLICATE_RETRIES = 3
+
 # =========================================================================== GENETIC ALGORITHM =======================================
 # Class to represent problems to be solved by means of a general
 # genetic algorithm. It includes the following attributes:
@@ -20,86 +44,135 @@ from .tabu import Tabu
 # =====================================================================================================================================
 
 class CVRP:
-    def __init__(self, max_capacity, matrix, nodes):
+    def __init__(self, max_capacity, matrix, nodes, route_cache=None, workers=1, seed=None, coords=None):
         self.max_capacity = max_capacity
         self.matrix = matrix
         self.nodes = nodes
+        self.coords = coords
         self.depot, self.genes = get_depot_and_genes(self.nodes)
+        # Chromosomes are rows of customer node indices, demands are looked up in a separate vector (depot included)
+        self.customers = np.arange(len(self.genes), dtype=np.int32)
+        self.demands = np.array([gen[1] for gen in self.genes] + [0])
+        self._in_slice = np.zeros(len(self.nodes), dtype=bool)
         self.tabu = Tabu(matrix, self.depot)
+        self.tabu_iterations = TABU_ITERATIONS
+        self.exact_route_size = EXACT_ROUTE_SIZE
+        # Nearest neighbours from the spatial index restrict the move and merge candidates, when coordinates are known
+        self.spatial = GridIndex(coords) if coords is not None else None
+        self.batch = BatchEvaluator(matrix, self.demands, self.depot[0], max_capacity)
+        self.local_search = LocalSearch(matrix, self.demands, self.depot[0], max_capacity, candidates=self.candidates(NEIGHBOURS))
+        self.route_cache = route_cache if route_cache is not None else RouteCache()
+        self.route_cache.bind(matrix)
+        self.workers = workers
+        # Every random choice is drawn from generators derived from this seed, so a run is reproducible regardless of
+        # how route optimizations get scheduled over the workers
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)
+        self._map_routes = self._optimize_routes
+        self._jobs = 0
+        self.stats = {}
+
+    def reset_stats(self):
+        self.stats = {'evaluations': 0, 'tabu_calls': 0, 'exact_routes': 0, 'tabu_calls_uncached': 0, 'educated': 0,
+                      'education_gain': 0, 'duplicate_evaluations': 0, 'mutations': 0, 'immigrants': 0, 'history': [],
+                      'diversity': []}
+
+    def candidates(self, k):
+        if self.spatial is None:
+            return None
+        return self.spatial.knn(k, exclude=self.depot[0])[:len(self.customers)]
+
+    def crossover(self, parent1, parent2, child1, child2):
+        # Order crossover (OX): a child keeps a slice of one parent and takes the remaining genes in the order they
+        # appear in the other one, starting after the slice, so it is a valid permutation without any repair scan
+        n = len(parent1)
+        a, b = sorted(self.random.sample(range(n + 1), 2))
+        for p1, p2, child in ((parent1, parent2, child1), (parent2, parent1, child2)):
+            self._in_slice[p1[a:b]] = True
+            rest = np.roll(p2, -b)
+            rest = rest[~self._in_slice[rest]]
+            self._in_slice[p1[a:b]] = False
+            child[a:b] = p1[a:b]
+            child[b:] = rest[:n - b]
+            child[:a] = rest[n - b:]
 
-    def crossover(self, parent1, parent2):
-        def process_gen_repeated(copy_child1, copy_child2):
-            count1 = 0
-            for gen1 in copy_child1[:pos]:
-                repeat = copy_child1.count(gen1)
-                if repeat > 1 and gen1[0] == self.depot[0]:
-                    repeat = 0
-                if repeat > 1:  # If need to fix repeated gen
-                    count2 = 0
-                    for gen2 in parent1[pos:]:  # Choose next available gen
-                        if gen2 not in copy_child1:
-                            child1[count1] = parent1[pos:][count2]
-                        count2 += 1
-                count1 += 1
-
-            count1 = 0
-            for gen1 in copy_child2[:pos]:
-                repeat = copy_child2.count(gen1)
-                if repeat > 1 and gen1[0] == self.depot[0]:
-                    repeat = 0
-                if repeat > 1:  # If need to fix repeated gen
-                    count2 = 0
-                    for gen2 in parent2[pos:]:  # Choose next available gen
-                        if gen2 not in copy_child2:
-                            child2[count1] = parent2[pos:][count2]
-                        count2 += 1
-                count1 += 1
-
-            return [[child1, np.inf], [child2, np.inf]]
-
-        pos = random.randrange(1, len(self.nodes))
-        child1 = parent1[:pos] + parent2[pos:]
-        child2 = parent2[:pos] + parent1[pos:]
-
-        return process_gen_repeated(child1, child2)
+    def mutate(self, chromosome):
+        # Reverses a random segment of the giant tour
+        a, b = sorted(self.random.sample(range(len(chromosome) + 1), 2))
+        chromosome[a:b] = chromosome[a:b][::-1].copy()
+        self.stats['mutations'] += 1
+
+    def split_routes(self, chromosome):
+        # Optimal capacity cuts of the giant tour, as (start, end) slices of the chromosome
+        return split_tour(chromosome, self.demands, self.matrix, self.depot[0], self.max_capacity)[0]
 
     def fitnessVRP(self, chromosome):
-        new_chromosome = []
-        fitness_value = 0
-        cap = 0
-        route = [self.depot]
-        for i in range(len(chromosome[0])):
-            cap += chromosome[0][i][1]
-            route.append(chromosome[0][i])
-            if i + 1 == len(chromosome[0]) or cap + chromosome[0][i + 1][1] > self.max_capacity:
-                solution, distance = self.tabu.execute(route, 5)
-                solution = self.tabu.reorder_solution(route, solution)
-                new_chromosome += list(map(lambda p: route[p], solution))
-                fitness_value += distance
-                # if i+1 == len(chromosome[0]):
-                #     break
-                cap = 0
-                route = [self.depot]
-        if fitness_value <= chromosome[1]:
-            chromosome[0] = new_chromosome
-            chromosome[1] = fitness_value
-        return chromosome[1]
+        # Scores the chromosome and writes the optimized order of its routes back into it
+        fitness, routes = self.evaluate(chromosome[None, :])
+        return fitness[0], routes[0]
+
+    def evaluate(self, chromosomes):
+        # Scores a batch of chromosomes, writing the optimized order of their routes back into them. Routes missing from
+        # the cache are collected first and optimized in one go, each distinct customer set once. The whole batch is
+        # split at once
+        splits = [route_bounds(route_starts) for route_starts in self.batch.split(chromosomes)[1]]
+        resolved = {}
+        pending = {}
+        for chromosome, bounds in zip(chromosomes, splits):
+            for start, end in bounds:
+                key = frozenset(chromosome[start:end].tolist())
+                if key in resolved or key in pending:
+                    continue
+                cached = self.route_cache.get(key)
+                if cached:
+                    resolved[key] = cached
+                else:
+                    pending[key] = (chromosome[start:end].tolist(), (self.seed, self._jobs))
+                    self._jobs += 1
+        for key, optimized in zip(pending, self._map_routes(list(pending.values()))):
+            self.route_cache.put(key, optimized)
+            resolved[key] = optimized
+        exact = sum(len(customers) <= self.exact_route_size for customers, _ in pending.values())
+        self.stats['exact_routes'] += exact
+        self.stats['tabu_calls'] += len(pending) - exact
+
+        fitness = np.zeros(len(chromosomes))
+        for i, (chromosome, bounds) in enumerate(zip(chromosomes, splits)):
+            for start, end in bounds:
+                order, distance = resolved[frozenset(chromosome[start:end].tolist())]
+                chromosome[start:end] = order
+                fitness[i] += distance
+        self.stats['evaluations'] += len(chromosomes)
+        return fitness, np.array([len(bounds) for bounds in splits])
+
+    def educate(self, chromosome):
+        # Memetic step: improves the decoded routes with inter-route moves and writes them back into the chromosome
+        routes, cost = self.local_search.improve(chromosome[start:end].tolist() for start, end in self.split_routes(chromosome))
+        chromosome[:] = np.concatenate(routes)
+        return cost, len(routes)
+
+    def _optimize_routes(self, jobs):
+        return [optimize_route(self.tabu, customers, self.tabu_iterations, seed, self.exact_route_size) for customers, seed in jobs]
+
+    @contextmanager
+    def route_workers(self):
+        # Moves route optimization onto a process pool for the duration of the block when more than one worker is set
+        if self.workers <= 1:
+            yield
+            return
+        if not can_start_processes():
+            print(f'Route optimization runs serially instead of on {self.workers} workers within a daemonic process')
+            yield
+            return
+        with route_pool(self.workers, self.matrix, self.depot, self.tabu_iterations, self.exact_route_size) as map_routes:
+            self._map_routes = map_routes
+            try:
+                yield
+            finally:
+                self._map_routes = self._optimize_routes
 
     def decodeVRP(self, chromosome):
-        c_res = []
-        cap = 0
-        route = [self.depot[0]]
-        for i in range(len(chromosome[0])):
-            cap += chromosome[0][i][1]
-            route.append(chromosome[0][i][0])
-            if i+1 == len(chromosome[0]) or cap + chromosome[0][i+1][1] > self.max_capacity:
-                route.append(self.depot[0])
-                c_res.append(route)
-                # if i+1 == len(chromosome[0]):
-                #     break
-                cap = 0
-                route = [self.depot[0]]
-        return c_res
+        return [[self.depot[0]] + chromosome[start:end].tolist() + [self.depot[0]] for start, end in self.split_routes(chromosome)]
 
     # ========================================================== FIRST PART: GENETIC OPERATORS============================================
     # Here We defined the requierements functions that the GA needs to work
@@ -113,55 +186,186 @@ class CVRP:
     # * size: number of individuals for each generation
     # * ratio_cross: portion of the population which will be obtained by
     #     means of crossovers.
-    # * prob_mutate: probability that a gene mutation will take place.
+    # * prob_mutate: probability that an offspring gets mutated (raised to ADAPTIVE_MUTATION while diversity is low).
+    # * dedupe: whether individuals already present in the next generation get mutated until they are unique.
+    # * seed_ratio: portion of the initial population built by construction heuristics instead of random shuffling
+    # * prob_educate: probability that an offspring gets improved by inter-route local search
+    # * time_limit: seconds after which the best individual found so far is returned
+    # * max_stall: number of generations without improvement of the best individual after which it is returned
     # =====================================================================================================================================
 
 
-    def genetic_algorithm_t(self, k, opt, ngen, size, ratio_cross):  # , prob_mutate
-        def initial_population(size):
-            def generate_chromosome():
-                chromosome_copy = self.genes.copy()
-                random.shuffle(chromosome_copy)
-                return chromosome_copy
+    def genetic_algorithm_t(self, k, opt, ngen, size, ratio_cross, migrate=None, time_limit=None, max_stall=None,
+                            seed_ratio=0.1, prob_educate=0.25, prob_mutate=0., dedupe=True):
+        def initial_population(population):
+            seeded = construct_tours(self.matrix, self.depot[0], self.demands, self.max_capacity, self.customers,
+                                     round(size * seed_ratio), self.coords, np.random.default_rng(self.random.getrandbits(64)),
+                                     self.candidates(SAVINGS_NEIGHBOURS))
+            for chromosome, tour in zip(population, seeded):
+                chromosome[:] = tour
+            for chromosome in population[len(seeded):]:
+                chromosome[:] = self.customers
+                self.random.shuffle(chromosome)
+
+        # Every individual is scored exactly once, right after it is created, so that selection only compares cached
+        # fitness values instead of re-running Tabu on each tournament draw
+        def evaluate(population, fitness, routes, educate=False):
+            pending = np.flatnonzero(np.isinf(fitness))
+            # Pending individuals identical to one before them in the population are paid for twice
+            seen = set()
+            for i, chromosome in enumerate(population):
+                key = chromosome.tobytes()
+                if key in seen and np.isinf(fitness[i]):
+                    self.stats['duplicate_evaluations'] += 1
+                seen.add(key)
+            if len(pending):
+                chromosomes = population[pending]
+                fitness[pending], routes[pending] = self.evaluate(chromosomes)
+                for i, chromosome in enumerate(chromosomes):
+                    if educate and self.random.random() < prob_educate:
+                        cost, routes[pending[i]] = self.educate(chromosome)
+                        self.stats['educated'] += 1
+                        self.stats['education_gain'] += fitness[pending[i]] - cost
+                        fitness[pending[i]] = cost
+                population[pending] = chromosomes
+
+        def cached_fitness(i):
+            # Tabu calls that scoring this draw would have cost if fitness wasn't cached
+            self.stats['tabu_calls_uncached'] += routes[i]
+            return fitness[i]
 
-            return [[generate_chromosome(), np.inf] for _ in range(size)]
+        def new_generation_t(k, opt, n_parents, n_directs, prob_mutate):
+            def tournament_selection(n, k, opt):
+                return [opt(self.random.sample(range(size), k), key=cached_fitness) for _ in range(n)]
 
-        def new_generation_t(k, opt, population, n_parents, n_directs):  # , prob_mutate
-            def tournament_selection(population, n, k, opt):
-                winners = []
-                for _ in range(n):
-                    elements = random.sample(population, k)
-                    winners.append(opt(elements, key=self.fitnessVRP))
-                return winners
+            directs = tournament_selection(n_directs, k, opt)
+            next_population[:n_directs] = population[directs]
+            next_fitness[:n_directs] = fitness[directs]
+            next_routes[:n_directs] = routes[directs]
 
-            def cross_parents(parents):
-                childs = []
-                for i in range(0, len(parents), 2):
-                    childs.extend(self.crossover(parents[i][0], parents[i + 1][0]))
-                return childs
+            parents = tournament_selection(n_parents, k, opt)
+            for i in range(0, n_parents, 2):
+                self.crossover(population[parents[i]], population[parents[i + 1]],
+                               next_population[n_directs + i], next_population[n_directs + i + 1])
+            next_fitness[n_directs:] = np.inf
+            for chromosome in next_population[n_directs:]:
+                if self.random.random() < prob_mutate:
+                    self.mutate(chromosome)
+            if dedupe:
+                # Hash-based duplicate filter: clones (of a tournament winner or of identical parents' offspring) get
+                # mutated, and re-evaluated, instead of crowding the next generation
+                seen = set()
+                for i, chromosome in enumerate(next_population):
+                    for _ in range(DUPLICATE_RETRIES):
+                        if chromosome.tobytes() not in seen:
+                            break
+                        self.mutate(chromosome)
+                        next_fitness[i] = np.inf
+                    seen.add(chromosome.tobytes())
+            evaluate(next_population, next_fitness, next_routes, educate=True)
 
-            directs = tournament_selection(population, n_directs, k, opt)
-            crosses = cross_parents(tournament_selection(population, n_parents, k, opt))
-            # mutations = mutate(Problem_Genetic, crosses, prob_mutate)
-            new_generation = directs + crosses  # + mutations
+        def inject_immigrants(population, fitness, routes):
+            worst = np.argsort(fitness)[::-1][:round(size * IMMIGRANT_RATIO)]
+            for i in worst:
+                population[i] = self.customers
+                self.random.shuffle(population[i])
+            fitness[worst] = np.inf
+            evaluate(population, fitness, routes)
+            self.stats['immigrants'] += len(worst)
 
-            return new_generation
+        self.reset_stats()
+        # Two preallocated generations which swap roles every iteration
+        population = np.empty((size, len(self.customers)), dtype=np.int32)
+        next_population = np.empty_like(population)
+        fitness = np.full(size, np.inf)
+        next_fitness = np.empty_like(fitness)
+        routes = np.zeros(size, dtype=np.int64)
+        next_routes = np.empty_like(routes)
 
-        population = initial_population(size)
         n_parents = round(size * ratio_cross)
         n_parents = (n_parents if n_parents % 2 == 0 else n_parents - 1)
         n_directs = size - n_parents
 
-        for _ in range(ngen):
-            population = new_generation_t(k, opt, population, n_parents, n_directs)  # , prob_mutate
+        started = time()
+        with self.route_workers():
+            initial_population(population)
+            evaluate(population, fitness, routes)
+            best_fitness = opt(fitness)
+            self.stats['history'].append(best_fitness)
+            self.stats['diversity'].append(broken_pairs_diversity(population))
+            stall = 0
 
-        bestChromosome = opt(population, key=self.fitnessVRP)
+            for generation in range(ngen):
+                diverse = self.stats['diversity'][-1] >= DIVERSITY_THRESHOLD
+                new_generation_t(k, opt, n_parents, n_directs, prob_mutate if diverse else max(prob_mutate, ADAPTIVE_MUTATION))
+                population, next_population = next_population, population
+                fitness, next_fitness = next_fitness, fitness
+                routes, next_routes = next_routes, routes
+                diversity = broken_pairs_diversity(population)
+                if diversity < DIVERSITY_THRESHOLD:
+                    inject_immigrants(population, fitness, routes)
+                    diversity = broken_pairs_diversity(population)
+                self.stats['diversity'].append(diversity)
+                if migrate:
+                    migrate(generation, population, fitness, routes)
+
+                generation_best = opt(fitness)
+                self.stats['history'].append(generation_best)
+                if generation_best != best_fitness and opt(generation_best, best_fitness) == generation_best:
+                    best_fitness = generation_best
+                    stall = 0
+                else:
+                    stall += 1
+                if max_stall and stall >= max_stall:
+                    print(f'Stopped after {generation + 1} generations, no improvement in the last {stall}')
+                    break
+                if time_limit and time() - started >= time_limit:
+                    print(f'Stopped after {generation + 1} generations, time limit of {time_limit} secs. reached')
+                    break
+
+        best = opt(range(size), key=cached_fitness)
+        bestChromosome = (population[best].copy(), fitness[best])
         print(f'Chromosome: {bestChromosome}')
-        genotype = self.decodeVRP(bestChromosome)
+        print(f'''Evaluations: {self.stats['evaluations']}, tabu calls: {self.stats['tabu_calls']}, '''
+              f'''exactly solved routes: {self.stats['exact_routes']}, '''
+              f'''tabu calls saved: {self.stats['tabu_calls_uncached'] - self.stats['tabu_calls'] - self.stats['exact_routes']}, '''
+              f'route cache hits/misses: {self.route_cache.hits}/{self.route_cache.misses} ({len(self.route_cache)} cached), '
+              f'''educated offspring: {self.stats['educated']} (total gain {self.stats['education_gain']:.2f}), '''
+              f'''duplicate evaluations: {self.stats['duplicate_evaluations']}, mutations: {self.stats['mutations']}, '''
+              f'''immigrants: {self.stats['immigrants']}, final diversity: {self.stats['diversity'][-1]:.3f}''')
+        genotype = self.decodeVRP(bestChromosome[0])
         # print(f'Solution: {genotype[0]}')
 
         return bestChromosome, genotype
 
+    def warm_start(self, routes, new_customers, time_limit=None):
+        # Re-optimization from a previous solution instead of a whole GA run: its routes (customer node indices without
+        # the depot, stops no longer to be served already left out) get the new customers by cheapest feasible
+        # insertion, then rounds of optimal splitting with route optimization and inter-route local search run until
+        # they stop improving. Returns the routes as start does
+        started = time()
+        self.reset_stats()
+        routes = cheapest_insertion(self.matrix, self.depot[0], self.demands, self.max_capacity, routes, new_customers)
+        chromosome = np.concatenate([np.array(route, dtype=np.int32) for route in routes])
+        with self.route_workers():
+            fitness, _ = self.fitnessVRP(chromosome)
+            best = chromosome.copy()
+            self.stats['history'].append(fitness)
+            for _ in range(WARM_ROUNDS):
+                if time_limit and time() - started >= time_limit:
+                    break
+                self.educate(chromosome)
+                # Optimized route orders come from the route cache, so a round can also end up slightly worse
+                cost, _ = self.fitnessVRP(chromosome)
+                if cost >= fitness - EPS:
+                    break
+                fitness = cost
+                best[:] = chromosome
+                self.stats['history'].append(fitness)
+        print(f'''Warm start: {len(new_customers)} stops inserted, cost {self.stats['history'][0]:.2f} -> {fitness:.2f} '''
+              f'''after {len(self.stats['history']) - 1} improving rounds, total time: {time() - started:.2f} secs.''')
+        return self.decodeVRP(best)
+
     # ================================================THIRD PART: EXPERIMENTATION=========================================================
     # Run over the same instances both the standard GA (from first part) as well as the modified version (from second part).
     # Compare the quality of their results and their performance. Due to the inherent randomness of GA, the experiments performed over each instance should be run several times.
@@ -169,12 +373,25 @@ class CVRP:
 
     # ----------------------------------------MAIN PROGRAMA PRINCIPAL--------------------------------
 
-    def start(self, k):
+    def ga_params(self, params=None):
+        # GA_PARAMS overridden by the given ones (e.g. from the parameter policy), tabu_iterations among them setting the
+        # tabu search iterations of the route optimizations
+        params = dict(GA_PARAMS, **(params or {}))
+        self.tabu_iterations = params.pop('tabu_iterations', self.tabu_iterations)
+        return params
+
+    def start(self, k, islands=True, time_limit=None, max_stall=None, params=None):
+        # With islands the k instances run at the same time in separate processes and exchange their elite, otherwise
+        # (or when this process can't start others) they run one after another and share the time limit
         print(f'Executing {k} VRP instances...')
         tiempo_inicial_t2 = time()
+        params = dict(self.ga_params(params), max_stall=max_stall)
+        if islands and k > 1 and can_start_processes():
+            results = run_islands(self, k, **params, time_limit=time_limit)
+        else:
+            results = [self.genetic_algorithm_t(**params, time_limit=time_limit and time_limit / k) for _ in range(k)]
         genotypes = {}
-        for _ in range(k):
-            result = self.genetic_algorithm_t(2, min, 200, 100, 0.85)
+        for result in results:
             genotypes[result[0][1]] = (result[0], result[1])
 
         best = min(list(genotypes.keys()))
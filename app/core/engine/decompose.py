@@ -0,0 +1,158 @@
+from contextlib import redirect_stdout
+from io import StringIO
+from math import ceil, pi
+from multiprocessing import get_context
+from time import time
+
+import numpy as np
+
+from .cvrp import CVRP, GA_PARAMS
+from .local_search import NEIGHBOURS, LocalSearch
+from .matrix import build_w_matrix
+from .parallel import can_start_processes
+from .spatial import GridIndex, project
+
+CLUSTER_SIZE = 300
+KMEANS_ITERATIONS = 50
+# Customers whose nearest neighbours lie in another cluster tie the two clusters together for boundary repair
+BOUNDARY_NEIGHBOURS = 5
+
+def sweep_clusters(points, depot, cluster_size, rng=None):
+    # Angular sectors around the depot with (almost) equal numbers of customers, the sweep starting after the widest
+    # empty sector so that the first and the last cluster aren't neighbours across a dense area
+    customers = np.arange(len(points) - 1)
+    offsets = points[customers] - points[depot]
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    order = np.argsort(angles, kind='stable')
+    gaps = np.diff(np.append(angles[order], angles[order[0]] + 2 * pi))
+    order = np.roll(customers[order], -(int(gaps.argmax()) + 1))
+    return np.array_split(order, ceil(len(order) / cluster_size))
+
+def kmeans_clusters(points, depot, cluster_size, rng=None):
+    # Lloyd's k-means over the customers with k-means++ seeding, clusters aren't balanced so their sizes only average
+    # out to cluster_size
+    rng = rng or np.random.default_rng()
+    customers = points[:-1]
+    k = ceil(len(customers) / cluster_size)
+    centres = customers[[rng.integers(len(customers))]]
+    while len(centres) < k:
+        distances = ((customers[:, None, :] - centres[None, :, :]) ** 2).sum(axis=-1).min(axis=1)
+        centres = np.vstack((centres, customers[rng.choice(len(customers), p=distances / distances.sum())]))
+    labels = None
+    for _ in range(KMEANS_ITERATIONS):
+        new_labels = ((customers[:, None, :] - centres[None, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            if (labels == c).any():
+                centres[c] = customers[labels == c].mean(axis=0)
+    return [np.flatnonzero(labels == c) for c in range(k) if (labels == c).any()]
+
+CLUSTERING = {
+    'sweep': sweep_clusters,
+    'kmeans': kmeans_clusters,
+}
+
+def _subproblem(coords, nodes, customers, depot):
+    # Coordinates and nodes of a part of the instance, laid out as prepare_w_matrix returns them (depot last)
+    index = np.append(customers, depot)
+    return coords[index], [nodes[i] for i in index]
+
+def _solve_cluster(job):
+    coords, nodes, max_capacity, seed, time_limit, max_stall = job
+    with redirect_stdout(StringIO()):
+        best, genotype = CVRP(max_capacity, build_w_matrix(coords), nodes, seed=seed, coords=coords) \
+            .genetic_algorithm_t(**GA_PARAMS, time_limit=time_limit, max_stall=max_stall)
+    return float(best[1]), genotype
+
+class Decomposition:
+    # Cluster-first, route-second solve of imports too large for a single CVRP instance: the customers are partitioned
+    # around the depot into geographic clusters, each cluster is solved as an independent CVRP (in parallel over a
+    # process pool) and the merged routes of neighbouring clusters are repaired with inter-route local search. Only
+    # cluster-sized distance matrices are ever built
+    def __init__(self, max_capacity, coords, nodes, method='sweep', cluster_size=CLUSTER_SIZE, workers=1, seed=None):
+        if method not in CLUSTERING:
+            raise Exception(f"Unknown clustering method '{method}'")
+        self.max_capacity = max_capacity
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.nodes = nodes
+        self.depot = len(nodes) - 1
+        self.demands = np.array([int(node[1]) for node in nodes[:-1]] + [0])
+        self.method = method
+        self.cluster_size = cluster_size
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.stats = {}
+
+    def clusters(self):
+        return CLUSTERING[self.method](project(self.coords), self.depot, self.cluster_size, self.rng)
+
+    def solve_clusters(self, clusters, time_limit=None, max_stall=None):
+        # Routes of every cluster as lists of customer node indices of the whole instance, without the depot. With fewer
+        # workers than clusters the time limit is split between the rounds the pool needs to get through them. Clusters
+        # are solved one after another when this process can't start a pool
+        workers = self.workers if can_start_processes() else 1
+        rounds = ceil(len(clusters) / max(workers, 1))
+        seed = int(self.rng.integers(2 ** 32))
+        jobs = [(*_subproblem(self.coords, self.nodes, customers, self.depot), self.max_capacity, seed + i,
+                 time_limit and time_limit / rounds, max_stall) for i, customers in enumerate(clusters)]
+        if workers > 1:
+            with get_context().Pool(min(workers, len(jobs))) as pool:
+                results = pool.map(_solve_cluster, jobs, chunksize=1)
+        else:
+            results = [_solve_cluster(job) for job in jobs]
+        self.stats['cluster_cost'] = sum(cost for cost, _ in results)
+        return [[[int(customers[i]) for i in route[1:-1]] for route in genotype]
+                for customers, (_, genotype) in zip(clusters, results)]
+
+    def neighbouring_clusters(self, clusters):
+        # Pairs of clusters some customer of which has one of its nearest neighbours in the other one
+        cluster_of = np.full(len(self.nodes), -1)
+        for c, customers in enumerate(clusters):
+            cluster_of[customers] = c
+        near = GridIndex(self.coords).knn(BOUNDARY_NEIGHBOURS, exclude=self.depot)
+        a = np.repeat(cluster_of, near.shape[1])
+        b = cluster_of[near.ravel()]
+        pairs = {(min(i, j), max(i, j)) for i, j in zip(a.tolist(), b.tolist()) if i != j and i >= 0 and j >= 0}
+        return sorted(pairs)
+
+    def repair(self, clusters, routes):
+        # Inter-route local search over the routes of each pair of neighbouring clusters, on a matrix of just their
+        # customers. Routes are then reassigned to the cluster holding most of their customers, so moves across a
+        # boundary can carry on in the following pairs
+        cluster_of = np.full(len(self.nodes), -1)
+        for c, customers in enumerate(clusters):
+            cluster_of[customers] = c
+        gain = 0
+        for a, b in self.neighbouring_clusters(clusters):
+            pair_routes = routes[a] + routes[b]
+            if not pair_routes:
+                continue
+            customers = np.concatenate([np.array(route, dtype=np.int64) for route in pair_routes])
+            index = np.append(customers, self.depot)
+            local = {c: i for i, c in enumerate(customers.tolist())}
+            local_search = LocalSearch(build_w_matrix(self.coords[index]), self.demands[index], len(customers), self.max_capacity,
+                                       candidates=GridIndex(self.coords[index]).knn(NEIGHBOURS, exclude=len(customers))[:-1])
+            local_routes = [[local[c] for c in route] for route in pair_routes]
+            before = sum(local_search.route_cost(route) for route in local_routes)
+            improved, after = local_search.improve(local_routes)
+            gain += before - after
+            routes[a], routes[b] = [], []
+            for route in improved:
+                route = customers[route].tolist()
+                owners = cluster_of[route]
+                routes[a if (owners == a).sum() >= (owners == b).sum() else b].append(route)
+        self.stats['repair_gain'] = gain
+        return routes
+
+    def solve(self, time_limit=None, max_stall=None):
+        # Returns the routes as node index lists with the depot at both ends, as CVRP.start does
+        started = time()
+        clusters = self.clusters()
+        print(f'Decomposed {len(self.nodes) - 1} stops into {len(clusters)} {self.method} clusters '
+              f'of {min(map(len, clusters))} to {max(map(len, clusters))} stops')
+        routes = self.repair(clusters, self.solve_clusters(clusters, time_limit, max_stall))
+        print(f'''Clusters cost: {self.stats['cluster_cost']:.2f}, boundary repair gain: {self.stats['repair_gain']:.2f}, '''
+              f'total time: {time() - started:.1f} secs.')
+        return [[self.depot] + route + [self.depot] for cluster_routes in routes for route in cluster_routes]
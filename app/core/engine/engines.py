@@ -0,0 +1,19 @@
+from .alns import ALNS
+from .cvrp import CVRP
+
+# CVRP engines selectable with the engine query parameter of /start-algorithm. Each is built from the max capacity,
+# the distance matrix and the nodes (plus workers, seed and coords keywords), and its start(k, time_limit=...,
+# max_stall=..., params=...) returns the routes as node index lists with the depot at both ends. The params override
+# the engine's defaults, they're what the parameter policy has under the engine's name
+VRP_ENGINES = {
+    'ga': CVRP,
+    'alns': ALNS,
+}
+
+# TSP engines selectable with the tsp_engine query parameter of /start-algorithm (with use_tsp), run by the TSP task
+TSP_ENGINES = ('tabu', 'two_opt')
+
+def get_vrp_engine(engine):
+    if engine not in VRP_ENGINES:
+        raise Exception(f"Unknown VRP engine '{engine}'")
+    return VRP_ENGINES[engine]
@@ -0,0 +1,51 @@
+import numpy as np
+
+# Routes with up to this many customers are ordered exactly, longer ones by tabu search
+EXACT_ROUTE_SIZE = 9
+
+_layers = {}
+
+def _subset_layers(n):
+    # Bitmasks of the subsets of n customers, grouped by their size
+    if n not in _layers:
+        masks = np.arange(1 << n)
+        sizes = np.array([bin(mask).count('1') for mask in range(1 << n)])
+        _layers[n] = [masks[sizes == size] for size in range(n + 1)]
+    return _layers[n]
+
+def held_karp(matrix, depot, customers):
+    # Exact shortest tour from the depot through the customers and back, as the customers' visiting order and its cost.
+    # Bitmask DP over (visited subset, last customer), vectorized over all subsets of the same size, O(2^n * n^2)
+    customers = list(customers)
+    n = len(customers)
+    nodes = np.array(customers + [depot])
+    d = matrix[np.ix_(nodes, nodes)].astype(np.float64)
+    bits = 1 << np.arange(n)
+
+    cost = np.full((1 << n, n), np.inf)
+    parent = np.zeros((1 << n, n), dtype=np.int64)
+    cost[bits, np.arange(n)] = d[n, :n]
+    for masks in _subset_layers(n)[2:]:
+        # candidates[m, j, i]: reaching subset m ending at j from subset m without j ending at i
+        candidates = cost[masks[:, None] ^ bits[None, :]] + d[:n, :n].T[None, :, :]
+        best = candidates.argmin(axis=2)
+        best_cost = np.take_along_axis(candidates, best[:, :, None], 2)[:, :, 0]
+        in_mask = (masks[:, None] & bits[None, :]) > 0
+        cost[masks] = np.where(in_mask, best_cost, np.inf)
+        parent[masks] = best
+
+    full = (1 << n) - 1
+    total = cost[full] + d[:n, n]
+    last = int(total.argmin())
+    order = []
+    mask = full
+    for _ in range(n):
+        order.append(customers[last])
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    return tuple(order[::-1]), float(total.min())
+
+def optimize_route(tabu, customers, tabu_iterations, seed=None, exact_size=EXACT_ROUTE_SIZE):
+    # Order of a route's customers, exact for short routes and by tabu search for longer ones
+    if len(customers) <= exact_size:
+        return held_karp(tabu.matrix, tabu.depot[0], customers)
+    return tabu.optimize_route(customers, tabu_iterations, seed)
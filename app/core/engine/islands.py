@@ -0,0 +1,78 @@
+import random
+from multiprocessing import get_context
+from queue import Empty
+
+import numpy as np
+
+MIGRATION_INTERVAL = 20
+MIGRANTS = 2
+# Seconds between checks that the islands still running haven't died without reporting a result
+RESULT_POLL = 1
+
+def _migration(inbox, outbox, interval, migrants):
+    # Every interval generations the island sends copies of its elite to the next island in the ring and lets the
+    # individuals that have arrived from the previous one replace its worst, if they are better
+    def migrate(generation, population, fitness, routes):
+        if (generation + 1) % interval:
+            return
+        elite = np.argsort(fitness)[:migrants]
+        outbox.put((population[elite], fitness[elite], routes[elite]))
+        while True:
+            try:
+                rows, rows_fitness, rows_routes = inbox.get_nowait()
+            except Empty:
+                break
+            worst = np.argsort(fitness)[::-1][:len(rows)]
+            better = rows_fitness < fitness[worst]
+            population[worst[better]] = rows[better]
+            fitness[worst[better]] = rows_fitness[better]
+            routes[worst[better]] = rows_routes[better]
+    return migrate
+
+def _run_island(cvrp, island, params, inbox, outbox, results):
+    # Migrants still buffered for an island that has already finished must not keep this one from exiting
+    outbox.cancel_join_thread()
+    try:
+        cvrp.seed += island
+        cvrp.random = random.Random(cvrp.seed)
+        migrate = _migration(inbox, outbox, params.pop('migration_interval'), params.pop('migrants'))
+        results.put((island, cvrp.genetic_algorithm_t(**params, migrate=migrate), None))
+    except Exception as e:
+        results.put((island, None, str(e)))
+
+def run_islands(cvrp, islands, migration_interval=MIGRATION_INTERVAL, migrants=MIGRANTS, **params):
+    # Runs the given number of GA instances at the same time in separate processes, connected in a ring for elite migration, and returns
+    # their (bestChromosome, genotype) results in island order
+    ctx = get_context()
+    queues = [ctx.Queue() for _ in range(islands)]
+    results = ctx.Queue()
+    params.update(migration_interval=migration_interval, migrants=migrants)
+    processes = [ctx.Process(target=_run_island, args=(cvrp, i, dict(params), queues[i], queues[(i + 1) % islands], results))
+                 for i in range(islands)]
+    for process in processes:
+        process.start()
+    collected = {}
+    try:
+        suspects = set()
+        while len(collected) < islands:
+            try:
+                island, result, error = results.get(timeout=RESULT_POLL)
+                collected[island] = (island, result, error)
+            except Empty:
+                # An island killed from outside (e.g. by the OOM killer) never reports back. One that has just put its
+                # result and exited gets another poll for it to arrive
+                dead = {i for i, process in enumerate(processes) if i not in collected and not process.is_alive()}
+                if dead & suspects:
+                    i = min(dead & suspects)
+                    raise Exception(f'Island {i} exited with code {processes[i].exitcode} without a result')
+                suspects = dead
+    finally:
+        for process in processes:
+            if process.is_alive() and len(collected) < islands:
+                process.terminate()
+            process.join()
+    collected = list(collected.values())
+    errors = [error for _, _, error in collected if error]
+    if errors:
+        raise Exception(f'Island run failed: {errors[0]}')
+    return [result for _, result, _ in sorted(collected, key=lambda item: item[0])]
@@ -0,0 +1,128 @@
+import numpy as np
+
+from .matrix import tolerance
+
+NEIGHBOURS = 10
+EPS = 1e-9
+
+class LocalSearch:
+    # Inter-route improvement of a CVRP solution with relocate, swap and 2-opt* moves. Every move is scored in O(1) from
+    # the edges it changes, with capacities checked through route loads, and only moves bringing a customer next to one
+    # of its nearest neighbours are considered, so a pass costs O(n * neighbours). Candidates (nearest customers per
+    # customer) usually come from the spatial index, otherwise they are found by scanning the matrix
+    def __init__(self, matrix, demands, depot, max_capacity, neighbours=NEIGHBOURS, candidates=None):
+        self.matrix = matrix
+        self.demands = demands.tolist()
+        self.depot = depot
+        self.max_capacity = max_capacity
+        self.eps = tolerance(matrix, EPS)
+        self.candidates = np.asarray(candidates).tolist() if candidates is not None else self._nearest(neighbours)
+
+    def _nearest(self, neighbours):
+        customers = np.arange(len(self.demands) - 1)
+        k = min(neighbours, len(customers) - 1)
+        distances = self.matrix[np.ix_(customers, customers)].astype(np.float64)
+        np.fill_diagonal(distances, np.inf)
+        near = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(near, np.argsort(np.take_along_axis(distances, near, 1), axis=1), 1).tolist()
+
+    def improve(self, routes, max_moves=None):
+        # Applies improving moves to the routes (lists of customers without the depot) until none is left, returns the
+        # improved routes and their total cost
+        self.routes = [list(route) for route in routes]
+        self.route_of = {}
+        self.prefix_loads = [None] * len(self.routes)
+        self.loads = [0] * len(self.routes)
+        for r in range(len(self.routes)):
+            self._index(r)
+
+        moves = 0
+        improved = True
+        while improved and (max_moves is None or moves < max_moves):
+            improved = False
+            for u in [c for route in self.routes for c in route]:
+                for v in self.candidates[u]:
+                    if self.route_of[u][0] != self.route_of[v][0] and \
+                            (self._relocate(u, v) or self._swap(u, v) or self._two_opt_star(u, v)):
+                        improved = True
+                        moves += 1
+                        break
+
+        routes = [route for route in self.routes if route]
+        return routes, sum(self.route_cost(route) for route in routes)
+
+    def route_cost(self, route):
+        d = self.matrix
+        return d[self.depot, route[0]] + sum(d[route[i], route[i + 1]] for i in range(len(route) - 1)) + d[route[-1], self.depot]
+
+    def _index(self, r):
+        # Positions and cumulative loads of a route, refreshed whenever a move changes it
+        load = 0
+        prefix = self.prefix_loads[r] = []
+        for i, c in enumerate(self.routes[r]):
+            self.route_of[c] = (r, i)
+            load += self.demands[c]
+            prefix.append(load)
+        self.loads[r] = load
+
+    def _neighbours(self, c):
+        # Predecessor and successor of a customer, the depot at route ends
+        r, i = self.route_of[c]
+        route = self.routes[r]
+        return route[i - 1] if i else self.depot, route[i + 1] if i + 1 < len(route) else self.depot
+
+    def _relocate(self, u, v):
+        # Moves u right before or right after v
+        ru, iu = self.route_of[u]
+        rv, iv = self.route_of[v]
+        if self.loads[rv] + self.demands[u] > self.max_capacity:
+            return False
+        d = self.matrix
+        pu, nu = self._neighbours(u)
+        pv, nv = self._neighbours(v)
+        removal = d[pu, nu] - d[pu, u] - d[u, nu]
+        for position, (a, b) in ((iv, (pv, v)), (iv + 1, (v, nv))):
+            if removal + d[a, u] + d[u, b] - d[a, b] < -self.eps:
+                del self.routes[ru][iu]
+                self.routes[rv].insert(position, u)
+                self._index(ru)
+                self._index(rv)
+                return True
+        return False
+
+    def _swap(self, u, v):
+        ru, iu = self.route_of[u]
+        rv, iv = self.route_of[v]
+        change = self.demands[v] - self.demands[u]
+        if self.loads[ru] + change > self.max_capacity or self.loads[rv] - change > self.max_capacity:
+            return False
+        d = self.matrix
+        pu, nu = self._neighbours(u)
+        pv, nv = self._neighbours(v)
+        delta = d[pu, v] + d[v, nu] + d[pv, u] + d[u, nv] - d[pu, u] - d[u, nu] - d[pv, v] - d[v, nv]
+        if delta >= -self.eps:
+            return False
+        self.routes[ru][iu], self.routes[rv][iv] = v, u
+        self._index(ru)
+        self._index(rv)
+        return True
+
+    def _two_opt_star(self, u, v):
+        # Cuts both routes and exchanges their tails, so that u is followed by v: u's route keeps its head up to u and
+        # continues with v and the rest of v's route, which in turn takes over the tail that followed u
+        ru, iu = self.route_of[u]
+        rv, iv = self.route_of[v]
+        route_u, route_v = self.routes[ru], self.routes[rv]
+        head_u = self.prefix_loads[ru][iu]
+        head_v = self.prefix_loads[rv][iv - 1] if iv else 0
+        if head_u + self.loads[rv] - head_v > self.max_capacity or head_v + self.loads[ru] - head_u > self.max_capacity:
+            return False
+        d = self.matrix
+        nu = route_u[iu + 1] if iu + 1 < len(route_u) else self.depot
+        pv = route_v[iv - 1] if iv else self.depot
+        if d[u, v] + d[pv, nu] - d[u, nu] - d[pv, v] >= -self.eps:
+            return False
+        self.routes[ru], self.routes[rv] = route_u[:iu + 1] + route_v[iv:], route_v[:iv] + route_u[iu + 1:]
+        self._index(ru)
+        self._index(rv)
+        return True
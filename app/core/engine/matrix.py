@@ -0,0 +1,195 @@
+import os
+import weakref
+from tempfile import mkstemp
+
+import numpy as np
+
+from .spatial import EARTH_RADIUS_KM, GridIndex
+
+MATRIX_BLOCK_SIZE = 1024
+
+# Distances between the points of a and b (broadcast against each other, points on the last axis), their outer product
+# being the matrix rows
+
+def _euclidean(a, b):
+    return np.sqrt(((a - b) ** 2).sum(axis=-1))
+
+def _haversine(a, b):
+    # Both arguments are (lat, lon) pairs in radians, result is in kilometres
+    lat1, lon1 = a[..., 0], a[..., 1]
+    lat2, lon2 = b[..., 0], b[..., 1]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+METRICS = {
+    'euclidean': (lambda coords: coords, _euclidean),
+    'haversine': (np.radians, _haversine),
+}
+
+def convert_coords(coords, metric):
+    # Coordinates as the metric's distance function takes them
+    if metric not in METRICS:
+        raise Exception(f"Unknown distance metric '{metric}'")
+    return METRICS[metric][0](np.asarray(coords, dtype=np.float64))
+
+def w_matrix_blocks(coords, metric='haversine', block_size=MATRIX_BLOCK_SIZE, upper=False):
+    # Yields (start, rows) blocks of the distance matrix, the rows only from column start onwards if upper is set.
+    # Blocks keep the broadcasted temporaries at block_size * n instead of n * n
+    coords = convert_coords(coords, metric)
+    distance = METRICS[metric][1]
+    for start in range(0, len(coords), block_size):
+        yield start, distance(coords[start:start + block_size, None, :], (coords[start:] if upper else coords)[None, :, :])
+
+def build_w_matrix(coords, metric='haversine', block_size=MATRIX_BLOCK_SIZE, dtype=np.float64, out=None):
+    if out is None:
+        out = np.empty((len(coords), len(coords)), dtype=dtype)
+    for start, rows in w_matrix_blocks(coords, metric, block_size):
+        out[start:start + len(rows)] = rows
+    return out
+
+def _is_entry(key):
+    return isinstance(key, tuple) and isinstance(key[0], (int, np.integer)) and isinstance(key[1], (int, np.integer))
+
+def _index_arrays(key, n):
+    # Row and column index arrays (broadcast to the result's shape) that a dense n x n array would read for the key
+    rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+    i, j = (np.arange(n)[k] if isinstance(k, slice) else np.asarray(k) for k in (rows, cols))
+    if (isinstance(rows, slice) or isinstance(cols, slice)) and i.ndim and j.ndim:
+        i = i[:, None]
+    return np.broadcast_arrays(i, j)
+
+class CondensedMatrix:
+    # Symmetric distance matrix stored as its upper triangle without the diagonal, n * (n - 1) / 2 values, indexed like
+    # a dense array: scalars, (fancy) index arrays, np.ix_ grids and slices all return what the dense matrix would
+    def __init__(self, values, n):
+        self.values = values
+        self.n = n
+        self.shape = (n, n)
+        self.dtype = values.dtype
+        self.nbytes = values.nbytes
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if _is_entry(key):
+            # Single entries are what the local searches read most, so they skip the array handling
+            low, high = (int(key[0]), int(key[1])) if key[0] <= key[1] else (int(key[1]), int(key[0]))
+            return self.values[low * (2 * self.n - low - 1) // 2 + high - low - 1] if low != high else self.values.dtype.type(0)
+        i, j = _index_arrays(key, self.n)
+        low, high = np.minimum(i, j), np.maximum(i, j)
+        k = low * (2 * self.n - low - 1) // 2 + high - low - 1
+        if not k.ndim:
+            return self.values.dtype.type(0) if low == high else self.values[k]
+        return np.where(low == high, 0, self.values[np.where(low == high, 0, k)]).astype(self.dtype, copy=False)
+
+def build_condensed_matrix(coords, metric='haversine', block_size=MATRIX_BLOCK_SIZE, dtype=np.float32):
+    n = len(coords)
+    values = np.empty(n * (n - 1) // 2, dtype=dtype)
+    for start, rows in w_matrix_blocks(coords, metric, block_size, upper=True):
+        for r, row in enumerate(rows):
+            i = start + r
+            offset = i * (2 * n - i - 1) // 2
+            values[offset:offset + n - i - 1] = row[r + 1:]
+    return CondensedMatrix(values, n)
+
+# Nearest neighbours kept per stop by the sparse storage
+SPARSE_NEIGHBOURS = 16
+
+class SparseMatrix:
+    # Distances of each stop to its k nearest neighbours and of every stop to the depot, O(n * k) memory for instances
+    # beyond what any full matrix fits in. Every other entry is computed on demand from the coordinates, so it can still
+    # be indexed like a dense array, but only engines working on neighbour lists (and per-route submatrices) should be
+    # run on it: anything reading whole rows costs O(n) per row
+    def __init__(self, coords, metric='haversine', neighbours=SPARSE_NEIGHBOURS, depot=None):
+        self.points = convert_coords(coords, metric)
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.metric = metric
+        self.distance = METRICS[metric][1]
+        self.n = len(self.points)
+        self.shape = (self.n, self.n)
+        self.dtype = np.dtype(np.float64)
+        self.depot = self.n - 1 if depot is None else depot
+        # The grid index query computes a bounded block of distances at a time, also with a few stops far away from
+        # the rest, so the build stays within O(n * k) memory
+        self.neighbours = GridIndex(coords, metric).knn(neighbours)
+        near_distances = self.distance(self.points[:, None, :], self.points[self.neighbours])
+        self.depot_distances = self.distance(self.points, self.points[self.depot])
+        self.nbytes = self.neighbours.nbytes + near_distances.nbytes + self.depot_distances.nbytes
+        self.near = [dict(zip(row, distances)) for row, distances in zip(self.neighbours.tolist(), near_distances.tolist())]
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if _is_entry(key):
+            i, j = int(key[0]), int(key[1])
+            if j == self.depot:
+                return self.depot_distances[i]
+            if i == self.depot:
+                return self.depot_distances[j]
+            distance = self.near[i].get(j)
+            return distance if distance is not None else self.distance(self.points[i], self.points[j])
+        i, j = _index_arrays(key, self.n)
+        return self.distance(self.points[i], self.points[j])
+
+def _remove_file(path, owner):
+    # Forked solver processes hold the same matrix object, only the process which created the file removes it
+    if os.getpid() == owner and os.path.exists(path):
+        os.remove(path)
+
+def build_memmap_matrix(coords, metric='haversine', block_size=MATRIX_BLOCK_SIZE, dtype=np.float32, directory=None):
+    # Dense matrix in a .npy file mapped into memory read-only, so solver processes share the page cache instead of
+    # holding copies. Without a directory it goes to a temporary file removed once the matrix is garbage collected
+    fd, path = mkstemp(suffix='.npy', dir=directory)
+    os.close(fd)
+    matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(coords), len(coords)))
+    build_w_matrix(coords, metric, block_size, out=matrix)
+    matrix.flush()
+    del matrix
+    matrix = np.load(path, mmap_mode='r')
+    weakref.finalize(matrix, _remove_file, path, os.getpid())
+    return matrix
+
+# Storage of the distance matrix: dense float64 (the default), dense float32, the condensed upper triangle in float32,
+# a float32 memory-mapped file and the sparse nearest neighbour distances. All of them are indexed the same way by the
+# engines
+MATRIX_STORAGES = {
+    'dense': lambda coords, metric: build_w_matrix(coords, metric),
+    'float32': lambda coords, metric: build_w_matrix(coords, metric, dtype=np.float32),
+    'condensed': lambda coords, metric: build_condensed_matrix(coords, metric),
+    'memmap': lambda coords, metric: build_memmap_matrix(coords, metric),
+    'sparse': lambda coords, metric: SparseMatrix(coords, metric),
+}
+# Storages the automatic choice falls back to, from the most to the least precise (or fastest to read)
+AUTO_STORAGES = ('dense', 'float32', 'condensed', 'sparse')
+# Memory a matrix may take before the automatic choice moves to a more compact storage
+MATRIX_MEMORY_LIMIT = 2 * 2 ** 30
+
+def estimate_matrix_bytes(n, storage):
+    if storage == 'dense':
+        return n * n * 8
+    if storage in ('float32', 'memmap'):
+        return n * n * 4
+    if storage == 'condensed':
+        return n * (n - 1) // 2 * 4
+    # Index and distance arrays plus the per-stop lookups, at roughly 100 bytes per dict entry
+    return n * SPARSE_NEIGHBOURS * (8 + 8 + 100) + n * 8
+
+def choose_storage(n, memory_limit=MATRIX_MEMORY_LIMIT):
+    # The first storage in AUTO_STORAGES whose estimated size fits in the memory limit, sparse otherwise
+    return next((storage for storage in AUTO_STORAGES if estimate_matrix_bytes(n, storage) <= memory_limit), 'sparse')
+
+def build_matrix(coords, metric='haversine', storage='dense', memory_limit=MATRIX_MEMORY_LIMIT):
+    if storage == 'auto':
+        storage = choose_storage(len(coords), memory_limit)
+    if storage not in MATRIX_STORAGES:
+        raise Exception(f"Unknown distance matrix storage '{storage}'")
+    return MATRIX_STORAGES[storage](coords, metric)
+
+def tolerance(matrix, eps):
+    # Smallest cost change the engines count as an improvement. Rounding of single precision distances could otherwise
+    # make both a move and its reverse look improving, so it is scaled to the distances in that case
+    if np.dtype(matrix.dtype).itemsize >= 8:
+        return eps
+    return max(eps, float(np.finfo(matrix.dtype).eps) * 16 * float(np.max(matrix[0, :min(len(matrix), 4096)])))
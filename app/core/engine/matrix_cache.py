@@ -0,0 +1,134 @@
+import os
+from io import BytesIO
+from tempfile import mkstemp
+from time import time
+
+import numpy as np
+
+from .matrix import METRICS, build_w_matrix, convert_coords
+
+# Smallest share of a matrix's rows that have to be reused from the cached one for an incremental update, below it the
+# matrix is rebuilt from scratch
+MIN_REUSE = 0.5
+
+class NpyMatrixStore:
+    # Cached matrices as .npy files in a directory, the matrix itself read back memory-mapped so that only the reused
+    # part is ever loaded
+    max_bytes = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, name):
+        return os.path.join(self.directory, f'{key}-{name}.npy')
+
+    def load(self, key):
+        try:
+            ids = np.load(self._path(key, 'ids'))
+            coords = np.load(self._path(key, 'coords'))
+            matrix = np.load(self._path(key, 'matrix'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return ids, coords, matrix
+
+    def save(self, key, ids, coords, matrix):
+        # Each file is written aside and moved into place, so a concurrent load sees either the old or the new one
+        for name, array in (('matrix', matrix), ('coords', coords), ('ids', ids)):
+            fd, path = mkstemp(suffix='.npy', dir=self.directory)
+            with os.fdopen(fd, 'wb') as file:
+                np.save(file, array)
+            os.replace(path, self._path(key, name))
+
+class RedisMatrixStore:
+    # Cached matrices as .npy payloads in a Redis hash, needs a client that doesn't decode responses. Redis values are
+    # limited to 512 MB, i.e. a float64 matrix of about 8k stops
+    max_bytes = 512 * 2 ** 20 - 2 ** 10
+
+    def __init__(self, client):
+        self.client = client
+
+    def load(self, key):
+        fields = self.client.hgetall(key)
+        if not fields:
+            return None
+        return tuple(np.load(BytesIO(fields[name])) for name in (b'ids', b'coords', b'matrix'))
+
+    def save(self, key, ids, coords, matrix):
+        payloads = {}
+        for name, array in (('ids', ids), ('coords', coords), ('matrix', matrix)):
+            buffer = BytesIO()
+            np.save(buffer, array)
+            payloads[name] = buffer.getvalue()
+        self.client.hset(key, mapping=payloads)
+
+class MatrixCache:
+    # Dense distance matrices of the last solve per key (a user), with rows and columns labelled by address id. When the
+    # next solve's addresses are mostly the same ones, the rows and columns of the dropped addresses are left out, those
+    # of the added ones are computed, and the rest is copied over instead of recomputing the whole matrix
+    def __init__(self, store, min_reuse=MIN_REUSE):
+        self.store = store
+        self.min_reuse = min_reuse
+        self.hits = 0
+        self.misses = 0
+        self.stats = {}
+
+    def get(self, key, ids, coords, metric='haversine', dtype=np.float64):
+        started = time()
+        key = f'{key}-{metric}'
+        ids = np.asarray(ids, dtype=np.int64)
+        coords = np.asarray(coords, dtype=np.float64)
+        # The cache only ever saves work, a store that fails leaves the matrix to be built (or not saved) as without it
+        try:
+            cached = self.store.load(key)
+        except Exception as e:
+            print(f'Matrix cache load of {key} failed: {e}')
+            cached = None
+        matrix = None
+        if cached is not None:
+            matrix = self._update(ids, coords, *cached, metric, dtype)
+        if matrix is None:
+            self.misses += 1
+            matrix = build_w_matrix(coords, metric, dtype=dtype)
+            self.stats = {'hit': False, 'added': len(ids), 'dropped': 0}
+        else:
+            self.hits += 1
+        # An unchanged set of addresses in the same order is already stored as it is
+        if self.store.max_bytes is not None and matrix.nbytes > self.store.max_bytes:
+            print(f'Matrix of {key} not cached, its {matrix.nbytes / 2 ** 20:.0f} MB exceed the store limit')
+        elif not (self.stats['hit'] and not self.stats['added'] and np.array_equal(ids, cached[0]) and cached[2].dtype == dtype):
+            try:
+                self.store.save(key, ids, coords, matrix)
+            except Exception as e:
+                print(f'Matrix cache save of {key} failed: {e}')
+        self.stats['seconds'] = time() - started
+        print(f'''Matrix cache {'hit' if self.stats['hit'] else 'miss'} for {key}: {self.stats['added']} rows added, '''
+              f'''{self.stats['dropped']} dropped in {self.stats['seconds']:.3f} secs. (hits/misses: {self.hits}/{self.misses})''')
+        return matrix
+
+    def _update(self, ids, coords, cached_ids, cached_coords, cached_matrix, metric, dtype):
+        if cached_matrix.shape != (len(cached_ids), len(cached_ids)):
+            return None
+        # Addresses whose coordinates changed since are treated as dropped and added again
+        position = {address_id: i for i, address_id in enumerate(cached_ids.tolist())}
+        old = np.array([position.get(address_id, -1) for address_id in ids.tolist()], dtype=np.int64)
+        kept = old >= 0
+        kept[kept] = (cached_coords[old[kept]] == coords[kept]).all(axis=1)
+        if kept.sum() < self.min_reuse * len(ids):
+            return None
+
+        matrix = np.empty((len(ids), len(ids)), dtype=dtype)
+        new_kept, old_kept = np.flatnonzero(kept), old[kept]
+        if len(old_kept) == len(cached_ids) and (new_kept == old_kept).all():
+            # Only additions at the end (or no change at all), the cached matrix is copied as a whole block
+            matrix[:len(old_kept), :len(old_kept)] = cached_matrix
+        else:
+            matrix[np.ix_(new_kept, new_kept)] = cached_matrix[old_kept][:, old_kept]
+        added = np.flatnonzero(~kept)
+        if len(added):
+            points = convert_coords(coords, metric)
+            rows = METRICS[metric][1](points[added, None, :], points[None, :, :])
+            matrix[added] = rows
+            matrix[:, added] = rows.T
+        self.stats = {'hit': True, 'added': len(added), 'dropped': len(cached_ids) - len(new_kept)}
+        return matrix
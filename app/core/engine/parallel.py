@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from multiprocessing import current_process, get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .exact import optimize_route
+from .matrix import CondensedMatrix, SparseMatrix
+from .tabu import Tabu
+
+class SharedMatrix:
+    # Copy of the distance matrix in a shared memory block, which pool workers attach to once instead of receiving it
+    # pickled with every task. Memory-mapped matrices are shared through their file instead, without any copy, and the
+    # O(n * k) sparse ones are simply sent to every worker once
+    def __init__(self, matrix):
+        self.shm = None
+        if isinstance(matrix, np.memmap) and matrix.filename:
+            self.handle = ('memmap', matrix.filename, matrix.offset, matrix.shape, matrix.dtype.str)
+            return
+        if isinstance(matrix, SparseMatrix):
+            self.handle = ('sparse', matrix)
+            return
+        condensed = isinstance(matrix, CondensedMatrix)
+        values = matrix.values if condensed else matrix
+        self.shm = SharedMemory(create=True, size=values.nbytes)
+        np.ndarray(values.shape, values.dtype.str, buffer=self.shm.buf)[:] = values
+        self.handle = ('condensed' if condensed else 'dense', self.shm.name, values.shape, values.dtype.str, len(matrix))
+
+    def close(self):
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+
+def attach_matrix(kind, *args):
+    # The shared memory block (None for a memory-mapped file) and the matrix behind a SharedMatrix handle
+    if kind == 'memmap':
+        filename, offset, shape, dtype = args
+        return None, np.memmap(filename, dtype, 'r', offset, shape)
+    if kind == 'sparse':
+        return None, args[0]
+    name, shape, dtype, n = args
+    shm = SharedMemory(name=name)
+    values = np.ndarray(shape, dtype, buffer=shm.buf)
+    return shm, CondensedMatrix(values, n) if kind == 'condensed' else values
+
+def can_start_processes():
+    # Daemonic processes, such as the tasks of Celery's default prefork pool, aren't allowed to have children. Anything
+    # meant to run on a process pool runs in the calling process there instead, a worker started with --pool threads or
+    # --pool solo lets it use the pool
+    return not current_process().daemon
+
+_worker = {}
+
+def _init_worker(handle, depot, tabu_iterations, exact_size):
+    _worker['shm'], matrix = attach_matrix(*handle)
+    _worker['tabu'] = Tabu(matrix, depot)
+    _worker['tabu_iterations'] = tabu_iterations
+    _worker['exact_size'] = exact_size
+
+def _optimize_route(job):
+    customers, seed = job
+    return optimize_route(_worker['tabu'], customers, _worker['tabu_iterations'], seed, _worker['exact_size'])
+
+@contextmanager
+def route_pool(workers, matrix, depot, tabu_iterations, exact_size):
+    # Yields a map(jobs) function optimizing (customers, seed) jobs on a process pool, in order of the jobs
+    shared = SharedMatrix(matrix)
+    try:
+        with get_context().Pool(workers, _init_worker, (shared.handle, depot, tabu_iterations, exact_size)) as pool:
+            yield lambda jobs: pool.map(_optimize_route, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    finally:
+        shared.close()
@@ -0,0 +1,75 @@
+import json
+from copy import deepcopy
+
+from .alns import ALNS_PARAMS
+from .cvrp import GA_PARAMS, TABU_ITERATIONS
+
+# Solver parameters used when no rule of the policy says otherwise: the GA (CVRP.start and its tabu search iterations
+# per route), the ALNS and the TSP tabu search
+DEFAULT_PARAMS = {
+    'ga': dict({name: value for name, value in GA_PARAMS.items() if name != 'opt'}, tabu_iterations=TABU_ITERATIONS),
+    'alns': dict(ALNS_PARAMS),
+    'tsp': {'iterations': 1000},
+}
+# Generations a GA run may take when a time budget is given, which then decides when it stops
+TIMED_GENERATIONS = 10000
+# Rules applied to an instance in this order, each of them whose bounds its features fall within overriding the
+# parameters set so far. Bounds are inclusive [low, high] pairs, None for an open end
+DEFAULT_RULES = [
+    {'when': {'stops': [None, 50]}, 'params': {'ga': {'size': 60, 'ngen': 150}}},
+    {'when': {'stops': [201, None]}, 'params': {'ga': {'size': 60, 'ngen': 120, 'tabu_iterations': 3},
+                                                'alns': {'iterations': 2000}, 'tsp': {'iterations': 500}}},
+    # Short routes (on average few stops fit in a vehicle) are mostly optimized exactly, so the GA can afford more of them
+    {'when': {'demand_ratio': [0.2, None]}, 'params': {'ga': {'ngen': 300}}},
+    # Only positive budgets get here, the engines take a time limit of 0 as unlimited and so do the features
+    {'when': {'time_budget': [0, None]}, 'params': {'ga': {'ngen': TIMED_GENERATIONS}}},
+]
+
+def instance_features(nodes, max_capacity=None, time_budget=None):
+    # Features the rules are matched against: number of stops, average demand as a share of the vehicle capacity (only
+    # for VRP) and the time budget in seconds (None when unlimited, which a budget of 0 or less is as well)
+    demands = [int(node[1]) for node in nodes[:-1]]
+    return {
+        'stops': len(demands),
+        'demand_ratio': sum(demands) / len(demands) / max_capacity if max_capacity and demands else None,
+        'time_budget': time_budget if time_budget and time_budget > 0 else None,
+    }
+
+def _matches(when, features):
+    for feature, (low, high) in when.items():
+        value = features.get(feature)
+        if value is None:
+            return False
+        if low is not None and value < low or high is not None and value > high:
+            return False
+    return True
+
+class ParameterPolicy:
+    # Table of rules picking solver parameters from instance features, written by the offline tuning harness
+    # (python -m benchmarks.tune_policy) to a JSON file and loaded when the tasks module is imported
+    def __init__(self, rules=None, defaults=None):
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.defaults = DEFAULT_PARAMS if defaults is None else defaults
+
+    def params(self, features):
+        # Parameters per solver ('ga', 'alns', 'tsp') for the features
+        params = deepcopy(self.defaults)
+        for rule in self.rules:
+            if _matches(rule['when'], features):
+                for solver, overrides in rule['params'].items():
+                    params.setdefault(solver, {}).update(overrides)
+        return params
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            table = json.load(file)
+        # Solvers missing from the file keep their default parameters
+        defaults = deepcopy(DEFAULT_PARAMS)
+        for solver, params in table.get('defaults', {}).items():
+            defaults.setdefault(solver, {}).update(params)
+        return cls(table.get('rules', []), defaults)
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({'defaults': self.defaults, 'rules': self.rules}, file, indent=2)
@@ -0,0 +1,109 @@
+from math import ceil
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+POINTS_PER_CELL = 4
+# Share of the points at either end of each axis left out when sizing the grid, so that a few far away points (a wrongly
+# geocoded address) don't stretch the cells over the whole city. They are put in the border cells instead
+OUTLIER_QUANTILE = 0.01
+# Point pairs whose distances a k-nearest query computes at a time, 16 MB of float64 differences per step
+KNN_BLOCK = 2 ** 20
+
+def project(coords, metric='haversine'):
+    # Planar coordinates for the index: an equirectangular projection in kilometres around the centre of the points for
+    # (lat, lon) degrees under the haversine metric, which is accurate to well below a percent at city scale
+    coords = np.asarray(coords, dtype=np.float64)
+    if metric != 'haversine':
+        return coords
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return EARTH_RADIUS_KM * np.column_stack((lon * np.cos(lat.mean()), lat))
+
+class GridIndex:
+    # Uniform grid over the stop coordinates, with points stored cell by cell (CSR layout), for k-nearest and radius
+    # queries that only look at the cells around a point. Built once per solve in O(n log n). The grid covers the
+    # points between the OUTLIER_QUANTILE quantiles of each axis (the full range of an axis they collapse on), points
+    # beyond it going to the border cells, which therefore reach out to infinity
+    def __init__(self, coords, metric='haversine', points_per_cell=POINTS_PER_CELL):
+        self.points = project(coords, metric)
+        low, high = np.quantile(self.points, [OUTLIER_QUANTILE, 1 - OUTLIER_QUANTILE], axis=0)
+        collapsed = high - low <= 0
+        low[collapsed], high[collapsed] = self.points.min(axis=0)[collapsed], self.points.max(axis=0)[collapsed]
+        self.low = low
+        extent = np.maximum(high - low, 1e-9)
+        self.cell_size = max(np.sqrt(extent.prod() * points_per_cell / len(self.points)), extent.max() / 1024, 1e-9)
+        self.shape = (np.floor(extent / self.cell_size).astype(np.int64) + 1)
+        self.cells = self._cell(self.points)
+        keys = self.cells[:, 0] * self.shape[1] + self.cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.shape.prod() + 1))
+
+    def _cell(self, points):
+        return np.clip(np.floor((points - self.low) / self.cell_size), 0, self.shape - 1).astype(np.int64)
+
+    def _bounds(self, cx, cy, w):
+        # First and last cell along each axis of the (2w + 1)^2 cells around cell (cx, cy), cut off at the grid border
+        sx, sy = self.shape.tolist()
+        return min(max(cx - w, 0), sx - 1), min(max(cy - w, 0), sy - 1), min(max(cx + w, 0), sx - 1), min(max(cy + w, 0), sy - 1)
+
+    def _margins(self, points, cx, cy, w):
+        # Distance of every point to the edge of the block of cells around cell (cx, cy): anything closer to it than
+        # that is inside the block. Border cells are open towards the outside of the grid
+        x0, y0, x1, y1 = self._bounds(cx, cy, w)
+        sx, sy = self.shape.tolist()
+        (lx, ly), size = self.low.tolist(), self.cell_size
+        low = (-np.inf if x0 == 0 else lx + x0 * size, -np.inf if y0 == 0 else ly + y0 * size)
+        high = (np.inf if x1 == sx - 1 else lx + (x1 + 1) * size, np.inf if y1 == sy - 1 else ly + (y1 + 1) * size)
+        return np.minimum(points - low, high - points).min(axis=1)
+
+    def _block(self, cx, cy, w):
+        # Indices of the points in the (2w + 1)^2 cells around cell (cx, cy)
+        x0, y0, x1, y1 = self._bounds(cx, cy, w)
+        rows = [self.order[self.starts[x * self.shape[1] + y0]:self.starts[x * self.shape[1] + y1 + 1]] for x in range(x0, x1 + 1)]
+        return np.concatenate(rows)
+
+    def radius(self, point, r):
+        # Indices of the points within distance r of the given point (index into the coordinates, or a projected point)
+        p = self.points[point] if np.ndim(point) == 0 else np.asarray(point, dtype=np.float64)
+        cx, cy = self._cell(p)
+        candidates = self._block(cx, cy, ceil(r / self.cell_size))
+        return candidates[np.hypot(*(self.points[candidates] - p).T) <= r]
+
+    def knn(self, k, exclude=None):
+        # (n, k) indices of every point's k nearest other points, closest first, skipping the excluded index if given.
+        # Points are handled a whole cell at a time, widening the block of cells around it until the k-th neighbour is
+        # certainly inside the block. Distances are computed for at most KNN_BLOCK point pairs at a time, so a crowded
+        # cell (or a far away point that needs the whole grid) doesn't take memory quadratic in its size
+        n = len(self.points)
+        k = min(k, n - 1 - (exclude is not None))
+        result = np.empty((n, max(k, 0)), dtype=np.int64)
+        if k <= 0:
+            # A single point (besides the excluded one) has no neighbours
+            return result
+        keys = np.flatnonzero(np.diff(self.starts))
+        for key in keys:
+            pending = self.order[self.starts[key]:self.starts[key + 1]]
+            cx, cy = divmod(key, self.shape[1])
+            w = 1
+            while len(pending):
+                candidates = self._block(cx, cy, w)
+                if exclude is not None:
+                    candidates = candidates[candidates != exclude]
+                if len(candidates) > k:
+                    # Once the block spans the whole grid every point is a candidate
+                    margins = np.full(len(pending), np.inf) if w >= self.shape.max() else self._margins(self.points[pending], cx, cy, w)
+                    done = np.zeros(len(pending), dtype=bool)
+                    step = max(KNN_BLOCK // len(candidates), 1)
+                    for start in range(0, len(pending), step):
+                        members = pending[start:start + step]
+                        distances = np.hypot(*(self.points[members][:, None, :] - self.points[candidates][None, :, :]).transpose(2, 0, 1))
+                        distances[members[:, None] == candidates[None, :]] = np.inf
+                        near = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                        near_distances = np.take_along_axis(distances, near, 1)
+                        found = near_distances.max(axis=1) <= margins[start:start + step]
+                        by_distance = np.argsort(near_distances[found], axis=1, kind='stable')
+                        result[members[found]] = candidates[np.take_along_axis(near[found], by_distance, 1)]
+                        done[start:start + step] = found
+                    pending = pending[~done]
+                w += 1
+        return result
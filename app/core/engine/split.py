@@ -0,0 +1,33 @@
+import numpy as np
+
+def split_tour(tour, demands, matrix, depot, max_capacity):
+    # Prins' split: optimally cuts a giant tour into capacity-feasible routes, as a shortest path over the DAG whose
+    # arc (i, j) is the route visiting tour[i:j]. Arcs are relaxed with running load and path length, so it's O(n * L)
+    # where L is the longest route that fits. Returns the routes as (start, end) slices of the tour and their total cost
+    n = len(tour)
+    depot_dist = matrix[depot, tour].tolist()
+    next_dist = matrix[tour[:-1], tour[1:]].tolist()
+    tour_demands = demands[tour].tolist()
+
+    cost = [0.0] + [np.inf] * n
+    pred = [0] * (n + 1)
+    for i in range(n):
+        load = 0
+        path = depot_dist[i]
+        for j in range(i, n):
+            load += tour_demands[j]
+            if j > i:
+                if load > max_capacity:
+                    break
+                path += next_dist[j - 1]
+            total = cost[i] + path + depot_dist[j]
+            if total < cost[j + 1]:
+                cost[j + 1] = total
+                pred[j + 1] = i
+
+    bounds = []
+    j = n
+    while j:
+        bounds.append((pred[j], j))
+        j = pred[j]
+    return bounds[::-1], cost[n]
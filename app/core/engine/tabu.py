@@ -1,55 +1,141 @@
-from random import shuffle
+from time import time
+
+import numpy as np
+
+EPS = 1e-9
+
+class RouteDistances:
+    # Distances between the nodes of a route by their route positions, read from the matrix on every access instead of
+    # copying the route's whole submatrix, for routes as long as a whole TSP import
+    def __init__(self, matrix, nodes):
+        self.matrix = matrix
+        self.nodes = nodes
+
+    def __getitem__(self, key):
+        return np.asarray(self.matrix[self.nodes[key[0]], self.nodes[key[1]]], dtype=np.float64)
 
 class Tabu:
-    def __init__(self, matrix, depot):
+    def __init__(self, matrix, depot, tenure=7, sample_size=2048, seed=None, candidates=None):
         self.matrix = matrix
         self.depot = depot
+        # Optional nearest node indices per node, sampled swaps then only pair a node with one of its neighbours
+        self.candidates = candidates
+        self.tenure = tenure
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+
+    def optimize_route(self, customers, max_iterations, seed=None):
+        # Tour through the depot and the given customers, as the customers' visiting order and the tour cost
+        route = [self.depot] + [(customer, 0) for customer in customers]
+        solution, cost = self.execute(route, max_iterations, seed)
+        return tuple(route[p][0] for p in self.reorder_solution(route, solution)), cost
+
+    def execute(self, route, max_iterations, seed=None, time_limit=None, max_stall=None):
+        # Stops early once time_limit seconds have passed or the best solution hasn't improved in max_stall iterations
+        started = time()
+        rng = self.rng if seed is None else np.random.default_rng(seed)
+        n = len(route)
+        if n < 4:  # Every cyclic order of up to 3 nodes has the same cost
+            best_solution = list(range(n))
+            return best_solution, self.compute_cost(route, best_solution)
+
+        nodes = np.fromiter((gen[0] for gen in route), dtype=np.intp, count=n)
+        # Small routes get their whole swap neighbourhood scored each iteration from a copy of their submatrix, larger
+        # ones a random sample of it read from the matrix
+        exhaustive = n * (n - 1) // 2 <= self.sample_size
+        dist = self.matrix[np.ix_(nodes, nodes)].astype(np.float64) if exhaustive else RouteDistances(self.matrix, nodes)
+        tour = np.arange(n)
+        best_tour = tour.copy()
+        cost = best_cost = dist[tour[:-1], tour[1:]].sum() + dist[tour[-1:], tour[:1]].sum()
+
+        if exhaustive:
+            a, b = np.triu_indices(n, 1)
+        elif self.candidates is not None:
+            lookup = np.full(len(self.matrix), -1)
+            lookup[nodes] = np.arange(n)
+            local_candidates = lookup[self.candidates[nodes]]
+        # pos[x] is the tour position of route node x
+        pos = np.arange(n)
+        tenure = min(self.tenure, n // 2)
+        # tabu_until[(x, y)] (x < y) is the first iteration in which swapping nodes x and y is allowed again. Only the pairs
+        # swapped within the tenure matter, so they're kept in a dict instead of an n x n array
+        tabu_until = {}
+        stall = 0
+
+        for it in range(max_iterations):
+            if max_stall and stall >= max_stall or time_limit and time() - started >= time_limit:
+                break
+            stall += 1
+            if not exhaustive:
+                a, b = self._sample_moves(rng, n) if self.candidates is None else self._sample_near_moves(rng, pos, local_candidates)
+            delta = self._swap_deltas(dist, tour, a, b)
+            x, y = tour[a], tour[b]
+            # The cheapest move that isn't tabu, or that is but leads to a new best solution (aspiration). It's almost always
+            # the cheapest one of all, the rest are only sorted when it isn't
+            m = None
+            for i in self._by_delta(delta):
+                key = (int(x[i]), int(y[i])) if x[i] < y[i] else (int(y[i]), int(x[i]))
+                if tabu_until.get(key, 0) <= it or cost + delta[i] < best_cost - EPS:
+                    m = i
+                    break
+            if m is None:
+                continue
+
+            tour[a[m]], tour[b[m]] = y[m], x[m]
+            pos[x[m]], pos[y[m]] = b[m], a[m]
+            cost += delta[m]
+            tabu_until[key] = it + 1 + tenure
+            if cost < best_cost - EPS:
+                best_tour[:] = tour
+                best_cost = cost
+                stall = 0
+
+        best_solution = best_tour.tolist()
+        return best_solution, self.compute_cost(route, best_solution)
+
+    @staticmethod
+    def _by_delta(delta):
+        first = int(np.argmin(delta))
+        yield first
+        for i in np.argsort(delta, kind='stable'):
+            if i != first:
+                yield int(i)
+
+    def _sample_moves(self, rng, n):
+        a = rng.integers(0, n, self.sample_size)
+        b = rng.integers(0, n - 1, self.sample_size)
+        b += b >= a
+        return np.minimum(a, b), np.maximum(a, b)
+
+    def _sample_near_moves(self, rng, pos, local_candidates):
+        # Swaps of a node x with the predecessor or successor of one of its neighbours y, which places x right next to y
+        n = len(pos)
+        x = rng.integers(0, n, self.sample_size)
+        y = local_candidates[x, rng.integers(0, local_candidates.shape[1], self.sample_size)]
+        x, y = x[y >= 0], y[y >= 0]
+        a = pos[x]
+        b = (pos[y] + rng.choice((-1, 1), len(y))) % n
+        return np.minimum(a, b)[a != b], np.maximum(a, b)[a != b]
 
-    def execute(self, route, max_iterations):
-        best_solution = list(range(len(route)))
-        best_cost = self.compute_cost(route, best_solution)
-        tabu_list = []
-
-        for _ in range(max_iterations):
-            # Generate a list of all possible moves
-            moves = []
-            for j in range(len(route)):
-                for k in range(len(route)):
-                    if j != k:
-                        moves.append((j, k))
-
-            # Shuffle the list of moves to introduce randomness
-            shuffle(moves)
-
-            # Iterate over the list of moves and select the first valid one
-            found_move = False
-            for j, k in moves:
-                if (j, k) not in tabu_list and (k, j) not in tabu_list:
-                    # Make the move
-                    solution = best_solution[:]
-                    solution[j], solution[k] = solution[k], solution[j]
-                    cost = self.compute_cost(route, solution)
-
-                    # Check if the move is an improvement
-                    if cost < best_cost:
-                        best_solution = solution
-                        best_cost = cost
-                        found_move = True
-                        break
-
-            # If no valid moves were found, reset the tabu list
-            if not found_move:
-                tabu_list = []
-
-            tabu_list.append((j, k))
-
-        return best_solution, best_cost
+    @staticmethod
+    def _swap_deltas(dist, tour, a, b):
+        # Cost change of swapping the nodes at tour positions a < b, computed from the affected edges only
+        n = len(tour)
+        x, y = tour[a], tour[b]
+        pa, na = tour[a - 1], tour[(a + 1) % n]
+        pb, nb = tour[b - 1], tour[(b + 1) % n]
+        delta = dist[pa, y] + dist[y, na] + dist[pb, x] + dist[x, nb] - dist[pa, x] - dist[x, na] - dist[pb, y] - dist[y, nb]
+        adjacent = b == a + 1  # ... pa x y nb ...
+        if adjacent.any():
+            delta[adjacent] = (dist[pa, y] + dist[y, x] + dist[x, nb] - dist[pa, x] - dist[x, y] - dist[y, nb])[adjacent]
+        wrapped = (a == 0) & (b == n - 1)  # ... pb y x na ...
+        if wrapped.any():
+            delta[wrapped] = (dist[pb, x] + dist[x, y] + dist[y, na] - dist[pb, y] - dist[y, x] - dist[x, na])[wrapped]
+        return delta
 
     def compute_cost(self, route, solution):
-        cost = 0
-        for i in range(len(route)):
-            cost += self.matrix[route[solution[i - 1]][0]][route[solution[i]][0]]
-        return cost
+        nodes = np.array([route[s][0] for s in solution])
+        return self.matrix[nodes, np.roll(nodes, -1)].sum()
 
     def reorder_solution(self, route, solution):
         # Find the index of the depot (node 0) in the solution
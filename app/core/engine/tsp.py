@@ -0,0 +1,157 @@
+from collections import deque
+from time import time
+
+import numpy as np
+
+from .matrix import tolerance
+
+NEIGHBOURS = 8
+OR_OPT_LENGTH = 3
+EPS = 1e-9
+
+def nearest_candidates(matrix, k, block_size=1024):
+    # Indices of each node's k nearest other nodes, closest first, computed in row blocks of the matrix
+    n = len(matrix)
+    k = min(k, n - 1)
+    candidates = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, block_size):
+        rows = np.array(matrix[start:start + block_size], dtype=np.float64)
+        rows[np.arange(len(rows)), np.arange(start, start + len(rows))] = np.inf
+        near = np.argpartition(rows, k - 1, axis=1)[:, :k]
+        candidates[start:start + block_size] = np.take_along_axis(near, np.argsort(np.take_along_axis(rows, near, 1), 1), 1)
+    return candidates
+
+class TwoOptTSP:
+    # TSP engine for large instances: a nearest neighbour tour improved by 2-opt and Or-opt moves restricted to each
+    # node's candidate list, driven by a queue of nodes whose don't-look bit is off. The tour is kept as an array with
+    # an inverse position array, a pass costs O(n * k) move evaluations plus the (mostly short) segment reversals
+    def __init__(self, matrix, neighbours=NEIGHBOURS, candidates=None):
+        self.matrix = matrix
+        self.eps = tolerance(matrix, EPS)
+        self.candidates = (candidates if candidates is not None else nearest_candidates(matrix, neighbours)).tolist()
+        self.n = len(self.candidates)
+
+    def solve(self, start, time_limit=None):
+        # Tour through all nodes starting at the given one (the depot), and its cost
+        self.tour = self.nearest_neighbour_tour(start)
+        self.improve(time_limit)
+        tour = np.roll(self.tour, -int(self.pos[start]))
+        return tour.tolist(), self.tour_cost(tour)
+
+    def tour_cost(self, tour):
+        return float(np.sum(self.matrix[tour, np.roll(tour, -1)]))
+
+    def nearest_neighbour_tour(self, start):
+        unvisited = np.ones(self.n, dtype=bool)
+        tour = np.empty(self.n, dtype=np.int64)
+        current = start
+        for i in range(self.n):
+            tour[i] = current
+            unvisited[current] = False
+            nearest = next((c for c in self.candidates[current] if unvisited[c]), None)
+            if nearest is None and i + 1 < self.n:
+                # All candidates visited already, fall back to scanning the whole row
+                options = np.flatnonzero(unvisited)
+                nearest = options[np.argmin(self.matrix[current, options])]
+            current = nearest
+        return tour
+
+    def improve(self, time_limit=None):
+        started = time()
+        self.pos = np.empty(self.n, dtype=np.int64)
+        self.pos[self.tour] = np.arange(self.n)
+        queue = deque(self.tour.tolist())
+        queued = np.ones(self.n, dtype=bool)
+        steps = 0
+        while queue:
+            a = queue.popleft()
+            queued[a] = False
+            touched = self._two_opt(a) or self._or_opt(a)
+            if touched:
+                for c in touched:
+                    if not queued[c]:
+                        queued[c] = True
+                        queue.append(c)
+            steps += 1
+            if time_limit and not steps % 256 and time() - started >= time_limit:
+                break
+
+    def _succ(self, a):
+        return self.tour[(self.pos[a] + 1) % self.n]
+
+    def _pred(self, a):
+        return self.tour[self.pos[a] - 1]
+
+    def _reverse(self, i, j):
+        # Reverses the cyclic tour segment between positions i and j, or equivalently its complement if that's shorter
+        n = self.n
+        length = (j - i) % n + 1
+        if 2 * length > n:
+            i, j, length = (j + 1) % n, (i - 1) % n, n - length
+        if length < 2:
+            return
+        idx = (i + np.arange(length)) % n
+        self.tour[idx] = self.tour[idx[::-1]]
+        self.pos[self.tour[idx]] = idx
+
+    def _two_opt(self, a):
+        d = self.matrix
+        for succ in (True, False):
+            b = self._succ(a) if succ else self._pred(a)
+            ab = d[a, b]
+            for c in self.candidates[a]:
+                ac = d[a, c]
+                if ac >= ab:
+                    break
+                e = self._succ(c) if succ else self._pred(c)
+                if c == b or e == a:
+                    continue
+                if ac + d[b, e] - ab - d[c, e] < -self.eps:
+                    # New edges a - c and b - e
+                    if succ:
+                        self._reverse(self.pos[b], self.pos[c])
+                    else:
+                        self._reverse(self.pos[a], self.pos[e])
+                    return a, b, c, e
+        return None
+
+    def _or_opt(self, a):
+        # Moves the segment of up to OR_OPT_LENGTH nodes starting at a next to one of a's candidates, in either orientation
+        d = self.matrix
+        n = self.n
+        i = self.pos[a]
+        p = self.tour[i - 1]
+        for length in range(1, min(OR_OPT_LENGTH, n - 3) + 1):
+            segment = self.tour[(i + np.arange(length)) % n].tolist()
+            e = segment[-1]
+            nx = self.tour[(i + length) % n]
+            removal = d[p, nx] - d[p, a] - d[e, nx]
+            for c in self.candidates[a]:
+                if c in segment:
+                    continue
+                for x, y in ((c, self._succ(c)), (self._pred(c), c)):
+                    if x in segment or y in segment:
+                        continue
+                    forward = d[x, a] + d[e, y]
+                    backward = d[x, e] + d[a, y]
+                    if removal + min(forward, backward) - d[x, y] < -self.eps:
+                        self._move_segment(i, length, x, forward > backward)
+                        return p, nx, a, e, x, y
+        return None
+
+    def _move_segment(self, i, length, x, reverse):
+        # Moves the segment at positions i .. i + length - 1 right after node x, shifting the shorter stretch between them
+        n = self.n
+        segment = self.tour[(i + np.arange(length)) % n]
+        if reverse:
+            segment = segment[::-1]
+        after = (self.pos[x] - (i + length - 1)) % n  # nodes between the segment end and x, x included
+        before = (i - 1 - self.pos[x]) % n  # nodes between x's successor and the segment start
+        if after <= before:
+            idx = (i + np.arange(after + length)) % n
+            values = np.concatenate((self.tour[idx[length:]], segment))
+        else:
+            idx = (self.pos[x] + 1 + np.arange(before + length)) % n
+            values = np.concatenate((segment, self.tour[idx[:before]]))
+        self.tour[idx] = values
+        self.pos[values] = idx
@@ -1,14 +1,29 @@
 from enum import Enum
 from os import environ
+from os.path import join
+from tempfile import gettempdir
+from random import randrange
+
+import numpy as np
+from celery import chord
 
 from requests import get as requests_get
 from sqlalchemy import exists, select
 
-from .common import save_import_status, save_execution_status
-from .engine.common import prepare_w_matrix, get_depot_and_genes
+from .common import save_import_status, save_execution_status, count_finished_execution_job, reset_execution_jobs, \
+    save_last_solution, get_last_solution
+from .engine.aggregate import aggregate_stops, expand_routes
+from .engine.common import prepare_nodes, get_depot_and_genes, get_w_matrix
 from .engine.cvrp import CVRP
+from .engine.decompose import Decomposition
+from .engine.engines import get_vrp_engine
+from .engine.matrix import CondensedMatrix, SparseMatrix
+from .engine.matrix_cache import MatrixCache, NpyMatrixStore, RedisMatrixStore
+from .engine.policy import ParameterPolicy, instance_features
 from .engine.tabu import Tabu
-from ..project.common import db, celery
+from .engine.spatial import GridIndex
+from .engine.tsp import NEIGHBOURS as TSP_NEIGHBOURS, TwoOptTSP
+from ..project.common import db, celery, redis_client_bin
 from .models import Address, Route, Point
 
 MAPBOX_API_KEY = environ.get('MAPBOX_API_KEY')
@@ -81,27 +96,164 @@ def create_link_and_add_route(user_id, res, coords, nodes):
     add_new_route(user_id, res, nodes, link, total_duration, total_distance)
 
 VRP_INSTANCES = 2
+VRP_WORKERS = int(environ.get('VRP_WORKERS', 1))
+# Number of independent GA runs a solve is fanned out to over the Celery workers, 0 or 1 solves within a single task
+VRP_DISTRIBUTED_JOBS = int(environ.get('VRP_DISTRIBUTED_JOBS', 0))
+# Imports with more stops than this are solved cluster-first, route-second, with clusters solved on this many processes
+# (only with a Celery pool whose tasks may start processes, see can_start_processes)
+VRP_DECOMPOSE_THRESHOLD = int(environ.get('VRP_DECOMPOSE_THRESHOLD', 1000))
+VRP_CLUSTER_WORKERS = int(environ.get('VRP_CLUSTER_WORKERS', 1))
+VRP_CLUSTERING = environ.get('VRP_CLUSTERING', 'sweep')
+# Stops within this many metres of each other are solved as a single node as long as they fit in a vehicle together,
+# 0 turns the aggregation off
+VRP_AGGREGATION_RADIUS = float(environ.get('VRP_AGGREGATION_RADIUS', 10))
+# Smallest share of the stops a warm start has to find in the previous solution, otherwise the solve starts from scratch
+WARM_START_MIN_REUSE = float(environ.get('WARM_START_MIN_REUSE', 0.5))
+# Storage of the distance matrix: dense (float64), float32, condensed (upper triangle), memmap (file shared by the
+# processes), sparse (nearest neighbour distances, the rest computed on demand) or auto, which picks the most precise
+# one whose estimated size fits in MATRIX_MEMORY_LIMIT megabytes
+MATRIX_STORAGE = environ.get('MATRIX_STORAGE', 'auto')
+MATRIX_MEMORY_LIMIT = int(environ.get('MATRIX_MEMORY_LIMIT', 2048)) * 2 ** 20
+# Where the last dense matrix of every user is kept for incremental updates: npy (files in MATRIX_CACHE_DIR), redis or none
+MATRIX_CACHE = environ.get('MATRIX_CACHE', 'npy')
+MATRIX_CACHE_DIR = environ.get('MATRIX_CACHE_DIR', join(gettempdir(), 'matrix-cache'))
+
+# JSON policy table written by the tuning harness (python -m benchmarks.tune_policy), the built-in one when not set
+SOLVER_POLICY = environ.get('SOLVER_POLICY')
+
+solver_policy = ParameterPolicy.load(SOLVER_POLICY) if SOLVER_POLICY else ParameterPolicy()
+
+def _create_matrix_cache():
+    if MATRIX_CACHE == 'npy':
+        return MatrixCache(NpyMatrixStore(MATRIX_CACHE_DIR))
+    if MATRIX_CACHE == 'redis':
+        return MatrixCache(RedisMatrixStore(redis_client_bin))
+    return None
+
+matrix_cache = _create_matrix_cache()
+
+def _get_w_matrix(user_id, coords, nodes):
+    return get_w_matrix(user_id, coords, nodes, storage=MATRIX_STORAGE, memory_limit=MATRIX_MEMORY_LIMIT, cache=matrix_cache)
+
+def add_VRP_routes(user_id, results, coords, nodes, max_capacity):
+    for res in results:
+        create_link_and_add_route(user_id, res, coords, nodes)
+    db.session.commit()
+    save_last_solution(user_id, nodes[-1][0], max_capacity, [[nodes[p][0] for p in res[1:-1]] for res in results])
+
+def warm_start_VRP(user_id, coords, nodes, max_capacity, time_limit=None):
+    # Routes of the user's last solution with the stops that are no longer unassigned left out and the new ones
+    # inserted, or None when there's no previous solution for the same depot and capacity covering enough of the stops
+    previous = get_last_solution(user_id)
+    if not previous or previous['depot_addr_id'] != nodes[-1][0] or previous['max_capacity'] != max_capacity:
+        return None
+    index = {node[0]: i for i, node in enumerate(nodes[:-1])}
+    routes = [[index[address_id] for address_id in route if address_id in index] for route in previous['routes']]
+    routes = [route for route in routes if route]
+    kept = {c for route in routes for c in route}
+    if len(kept) < WARM_START_MIN_REUSE * (len(nodes) - 1):
+        return None
+    new_customers = [c for c in range(len(nodes) - 1) if c not in kept]
+    return CVRP(max_capacity, _get_w_matrix(user_id, coords, nodes), nodes, workers=VRP_WORKERS, coords=coords) \
+        .warm_start(routes, new_customers, time_limit)
+
 @celery.task()
-def prepare_and_run_VRP(user_id, depot_addr_id, max_capacity):
+def run_VRP_job(user_id, coords, nodes, max_capacity, seed, jobs, time_limit=None, max_stall=None, params=None):
+    # A single GA run of a distributed solve, the matrix is rebuilt from the coordinates instead of being sent along
     try:
-        coords, matrix, nodes = prepare_w_matrix(user_id, depot_addr_id)
-        results = CVRP(max_capacity, matrix, nodes).start(VRP_INSTANCES)
-        for res in results:
-            create_link_and_add_route(user_id, res, coords, nodes)
-        db.session.commit()
+        matrix = _get_w_matrix(user_id, coords, nodes)
+        cvrp = CVRP(max_capacity, matrix, nodes, workers=VRP_WORKERS, seed=seed, coords=np.array(coords))
+        best, genotype = cvrp.genetic_algorithm_t(**cvrp.ga_params(params), time_limit=time_limit, max_stall=max_stall)
+        result = {'cost': float(best[1]), 'routes': genotype}
+    except Exception as e:
+        result = {'error': str(e)}
+    save_execution_status(user_id, TaskStatus.IN_PROGRESS, {'jobs_done': count_finished_execution_job(user_id), 'jobs': jobs})
+    return result
+
+@celery.task()
+def merge_VRP_results(results, user_id, coords, nodes, max_capacity, groups=None):
+    # With groups the jobs solved the aggregated instance, whose routes are expanded back to the given nodes
+    try:
+        reset_execution_jobs(user_id)
+        solved = [result for result in results if 'error' not in result]
+        if not solved:
+            raise Exception(results[0]['error'])
+        routes = min(solved, key=lambda result: result['cost'])['routes']
+        if groups:
+            routes = expand_routes(routes, groups, np.array(coords))
+        add_VRP_routes(user_id, routes, coords, nodes, max_capacity)
+        failed = len(results) - len(solved)
+        save_execution_status(user_id, TaskStatus.DONE, {'failed_jobs': failed} if failed else None)
+    except Exception as e:
+        save_execution_status(user_id, TaskStatus.ERROR, {'msg': str(e)})
+
+def dispatch_VRP_jobs(user_id, coords, nodes, max_capacity, jobs, time_limit=None, max_stall=None, params=None, reduced=None):
+    # The jobs solve the reduced instance instead when given, as the (coords, nodes, groups) of aggregate_stops
+    reset_execution_jobs(user_id)
+    save_execution_status(user_id, TaskStatus.IN_PROGRESS, {'jobs_done': 0, 'jobs': jobs})
+    solve_coords, solve_nodes, groups = reduced or (coords, nodes, None)
+    solve_coords = solve_coords.tolist()
+    seed = randrange(2 ** 32)
+    chord(run_VRP_job.s(user_id, solve_coords, solve_nodes, max_capacity, seed + i, jobs, time_limit, max_stall, params)
+          for i in range(jobs)) \
+        (merge_VRP_results.s(user_id, coords.tolist(), nodes, max_capacity, groups))
+
+@celery.task()
+def prepare_and_run_VRP(user_id, depot_addr_id, max_capacity, distributed_jobs=None, time_limit=None, max_stall=None,
+                        decompose=None, warm_start=False, engine='ga'):
+    # The engine solves the instance when it's done within this task, warm starts, decomposition clusters and
+    # distributed jobs always run the GA
+    try:
+        Engine = get_vrp_engine(engine)
+        coords, nodes = prepare_nodes(user_id, depot_addr_id)
+        params = solver_policy.params(instance_features(nodes, max_capacity, time_limit))
+        results = warm_start_VRP(user_id, coords, nodes, max_capacity, time_limit) if warm_start else None
+        # A solve without a usable previous solution falls back to a full one, of the instance with co-located stops
+        # aggregated
+        if results is None:
+            solve_coords, solve_nodes, groups = aggregate_stops(coords, nodes, max_capacity, VRP_AGGREGATION_RADIUS)
+            if decompose if decompose is not None else len(solve_nodes) - 1 > VRP_DECOMPOSE_THRESHOLD:
+                # The whole-instance matrix is never built in this mode, only the ones of the clusters
+                results = Decomposition(max_capacity, solve_coords, solve_nodes, VRP_CLUSTERING, workers=VRP_CLUSTER_WORKERS) \
+                    .solve(time_limit, max_stall)
+            else:
+                jobs = VRP_DISTRIBUTED_JOBS if distributed_jobs is None else distributed_jobs
+                if jobs > 1:
+                    dispatch_VRP_jobs(user_id, coords, nodes, max_capacity, jobs, time_limit, max_stall, params['ga'],
+                                      (solve_coords, solve_nodes, groups) if groups else None)
+                    return
+                matrix = _get_w_matrix(user_id, solve_coords, solve_nodes)
+                results = Engine(max_capacity, matrix, solve_nodes, workers=VRP_WORKERS, coords=solve_coords) \
+                    .start(VRP_INSTANCES, time_limit=time_limit, max_stall=max_stall, params=params[engine])
+            if groups:
+                results = expand_routes(results, groups, coords)
+        add_VRP_routes(user_id, results, coords, nodes, max_capacity)
         save_execution_status(user_id, TaskStatus.DONE)
     except Exception as e:
         save_execution_status(user_id, TaskStatus.ERROR, {'msg': str(e)})
 
 @celery.task()
-def prepare_and_run_TSP(user_id, depot_addr_id):
+def prepare_and_run_TSP(user_id, depot_addr_id, time_limit=None, max_stall=None, engine='tabu'):
     try:
-        coords, matrix, nodes = prepare_w_matrix(user_id, depot_addr_id)
+        coords, nodes = prepare_nodes(user_id, depot_addr_id)
+        matrix = _get_w_matrix(user_id, coords, nodes)
         depot, genes = get_depot_and_genes(nodes)
         genes.append(depot)
-        tabu = Tabu(matrix, depot)
-        solution, _ = tabu.execute(genes, 1000)
-        solution = tabu.reorder_solution(genes, solution)
+        if isinstance(matrix, (SparseMatrix, CondensedMatrix, np.memmap)):
+            # The compact storages are picked when a full float64 matrix doesn't fit in memory, the tabu search's
+            # float64 copy of the whole tour's submatrix and its index arrays wouldn't either
+            engine = 'two_opt'
+        if engine == 'two_opt':
+            # Neighbour-list 2-opt / Or-opt, meant for imports too large for the tabu search
+            solution, _ = TwoOptTSP(matrix, candidates=GridIndex(coords).knn(TSP_NEIGHBOURS)).solve(depot[0], time_limit)
+            solution = solution[1:]
+        elif engine == 'tabu':
+            tabu = Tabu(matrix, depot, candidates=GridIndex(coords).knn(TSP_NEIGHBOURS))
+            iterations = solver_policy.params(instance_features(nodes, time_budget=time_limit))['tsp']['iterations']
+            solution, _ = tabu.execute(genes, iterations, time_limit=time_limit, max_stall=max_stall)
+            solution = tabu.reorder_solution(genes, solution)
+        else:
+            raise Exception(f"Unknown TSP engine '{engine}'")
         depot_ind = [genes.index(depot)]
         create_link_and_add_route(user_id, depot_ind + solution + depot_ind, coords, nodes)
         db.session.commit()
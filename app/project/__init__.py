@@ -15,7 +15,7 @@ from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 
-from .common import db, redis_client, mail  # , redis_client_bin
+from .common import db, redis_client, mail, redis_client_bin
 from ..user.models import User
 from ..user import user_bp
 from ..core import core_bp
@@ -31,7 +31,7 @@ def create_app():
     app.register_blueprint(core_bp)
 
     db.init_app(app)
-    # redis_client_bin.init_app(app)
+    redis_client_bin.init_app(app)
     redis_client.init_app(app)
     mail.init_app(app)
 
@@ -5,7 +5,7 @@ from flask_redis import FlaskRedis
 from flask_sqlalchemy import SQLAlchemy
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 
-# redis_client_bin = FlaskRedis()
+redis_client_bin = FlaskRedis()
 
 db = SQLAlchemy()
 
@@ -0,0 +1,4 @@
+# Offline benchmarks for the routing engine, run from the repository root with `python -m benchmarks.<name>`
+
+# The engine is reached through the app.core blueprint package, which has to be initialized by app.project first
+import app.project  # noqa: F401
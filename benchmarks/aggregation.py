@@ -0,0 +1,61 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+
+import numpy as np
+
+from app.core.engine.aggregate import aggregate_stops, expand_routes
+from app.core.engine.cvrp import CVRP
+from app.core.engine.matrix import build_w_matrix
+from .common import random_coords, timed, print_table
+
+# About a metre in degrees of latitude
+METRE = 1 / 111320
+
+def building_instance(buildings, max_stops, spread, seed=0):
+    # Stops of 1 to max_stops deliveries per building, scattered within spread metres of it, the depot last
+    rng = np.random.default_rng(seed)
+    sites = random_coords(buildings, seed)
+    counts = rng.integers(1, max_stops + 1, buildings)
+    coords = np.repeat(sites, counts, axis=0) + rng.uniform(-spread, spread, (counts.sum(), 2)) * METRE
+    coords = np.concatenate((coords, random_coords(1, seed + 1)))
+    n = len(coords) - 1
+    nodes = [(i, int(demand), f'Stop {i}') for i, demand in enumerate(rng.integers(1, 4, n))] + [(n, 'Depot')]
+    return coords, nodes
+
+def solve(coords, nodes, capacity, seed):
+    matrix = build_w_matrix(coords)
+    with redirect_stdout(StringIO()):
+        return CVRP(capacity, matrix, nodes, seed=seed, coords=coords).start(1, islands=False)
+
+def solution_cost(matrix, routes):
+    return sum(matrix[route[:-1], route[1:]].sum() for route in routes)
+
+def main():
+    parser = ArgumentParser(description="VRP solve of every stop vs. co-located stops aggregated into single nodes")
+    parser.add_argument('--buildings', type=int, nargs='+', default=[30, 60, 120])
+    parser.add_argument('--max-stops', type=int, default=4, help="most deliveries to a single building")
+    parser.add_argument('--spread', type=float, default=5, help="metres the deliveries of a building are apart")
+    parser.add_argument('--radius', type=float, default=10, help="aggregation radius in metres")
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for buildings in args.buildings:
+        coords, nodes = building_instance(buildings, args.max_stops, args.spread, args.seed)
+        matrix = build_w_matrix(coords)
+        plain_time, plain = timed(solve, coords, nodes, args.capacity, args.seed)
+
+        def aggregated():
+            with redirect_stdout(StringIO()):
+                reduced_coords, reduced_nodes, groups = aggregate_stops(coords, nodes, args.capacity, args.radius)
+            return len(reduced_nodes) - 1, expand_routes(solve(reduced_coords, reduced_nodes, args.capacity, args.seed), groups, coords)
+        aggregated_time, (reduced, routes) = timed(aggregated)
+        rows.append((len(nodes) - 1, reduced, f'{(reduced + 1) ** 2 / len(nodes) ** 2:.1%}',
+                     f'{solution_cost(matrix, plain):.1f}', f'{plain_time:.1f}',
+                     f'{solution_cost(matrix, routes):.1f}', f'{aggregated_time:.1f}', f'{plain_time / aggregated_time:.1f}x'))
+    print_table(('stops', 'nodes', 'matrix size', 'all stops: cost', 'time (s)', 'aggregated: cost', 'time (s)', 'speedup'), rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from argparse import ArgumentParser
+
+import numpy as np
+
+from app.core.engine.batch import BatchEvaluator
+from app.core.engine.split import split_tour
+from .common import random_instance, timed, print_table
+
+def main():
+    parser = ArgumentParser(description="Split and cost of a whole population of giant tours: per-tour loop vs. batch evaluator")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--population', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords, matrix, nodes = random_instance(n, args.seed)
+        demands = np.array([node[1] for node in nodes[:-1]] + [0])
+        evaluator = BatchEvaluator(matrix, demands, n, args.capacity)
+        rng = np.random.default_rng(args.seed)
+        for size in args.population:
+            population = np.array([rng.permutation(n) for _ in range(size)], dtype=np.int32)
+            loop, _ = timed(lambda: [split_tour(tour, demands, matrix, n, args.capacity) for tour in population])
+            batch, _ = timed(evaluator.evaluate, population, repeat=3)
+            tours, _ = timed(evaluator.tour_costs, population, repeat=3)
+            rows.append((n, size, f'{loop:.3f}', f'{batch:.3f}', f'{loop / batch:.1f}x', f'{size / batch:.0f}', f'{tours:.4f}'))
+    print_table(('stops', 'tours', 'loop split (s)', 'batch split (s)', 'speedup', 'tours / s', 'batch tour costs (s)'), rows)
+
+if __name__ == '__main__':
+    main()
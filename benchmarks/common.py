@@ -0,0 +1,32 @@
+from time import perf_counter
+
+import numpy as np
+
+# Roughly the bounding box of Belgrade, where most of the real imports are located
+LAT_RANGE = (44.70, 44.90)
+LON_RANGE = (20.30, 20.60)
+
+def random_coords(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(*LAT_RANGE, n), rng.uniform(*LON_RANGE, n)))
+
+def random_instance(n, seed=0, max_demand=4):
+    # Coordinates, haversine matrix and nodes of n customers plus the depot, laid out as prepare_w_matrix returns them
+    from app.core.engine.matrix import build_w_matrix
+    coords = random_coords(n + 1, seed)
+    demands = np.random.default_rng(seed).integers(1, max_demand + 1, n)
+    nodes = [(i, int(demands[i]), f'Stop {i}') for i in range(n)] + [(n, 'Depot')]
+    return coords, build_w_matrix(coords), nodes
+
+def timed(fn, *args, repeat=1, **kwargs):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return best, result
+
+def print_table(header, rows):
+    widths = [max(len(str(v)) for v in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(row, widths)))
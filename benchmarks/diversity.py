@@ -0,0 +1,38 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+
+from app.core.engine.cvrp import CVRP, GA_PARAMS
+from .common import random_instance, print_table
+
+def run(coords, matrix, nodes, capacity, ngen, dedupe, seed):
+    cvrp = CVRP(capacity, matrix, nodes, seed=seed, coords=coords)
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        cvrp.genetic_algorithm_t(**dict(GA_PARAMS, ngen=ngen, dedupe=dedupe))
+    return cvrp.stats, perf_counter() - start
+
+def main():
+    parser = ArgumentParser(description="Evaluations spent on duplicate individuals and population diversity with and without "
+                                        "the duplicate filter")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--ngen', type=int, default=100)
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords, matrix, nodes = random_instance(n, args.seed)
+        for dedupe in (False, True):
+            stats, elapsed = run(coords, matrix, nodes, args.capacity, args.ngen, dedupe, args.seed)
+            rows.append((n, 'on' if dedupe else 'off', stats['evaluations'], stats['duplicate_evaluations'],
+                         f'''{stats['duplicate_evaluations'] / max(stats['evaluations'], 1):.1%}''', stats['immigrants'],
+                         f'''{min(stats['diversity']):.3f}''', f'''{stats['diversity'][-1]:.3f}''',
+                         f'''{stats['history'][-1]:.1f}''', f'{elapsed:.1f}'))
+    print_table(('stops', 'dedupe', 'evaluations', 'on duplicates', 'share', 'immigrants', 'min diversity',
+                 'final diversity', 'final cost', 'time (s)'), rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+
+from app.core.engine.engines import VRP_ENGINES
+from .common import random_instance, timed, print_table
+
+def solution_cost(matrix, routes):
+    return sum(matrix[route[:-1], route[1:]].sum() for route in routes)
+
+def main():
+    parser = ArgumentParser(description="Cost and wall time of every VRP engine on the same instances")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 500])
+    parser.add_argument('--engines', nargs='+', default=list(VRP_ENGINES), choices=list(VRP_ENGINES))
+    parser.add_argument('--instances', type=int, default=1, help="runs per engine (k of start), one after another")
+    parser.add_argument('--time-limit', type=float, default=None, help="time limit of a whole solve in seconds")
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords, matrix, nodes = random_instance(n, args.seed)
+        results = {}
+        for engine in args.engines:
+            solver = VRP_ENGINES[engine](args.capacity, matrix, nodes, seed=args.seed, coords=coords)
+            with redirect_stdout(StringIO()):
+                elapsed, routes = timed(solver.start, args.instances, islands=False, time_limit=args.time_limit)
+            results[engine] = (solution_cost(matrix, routes), elapsed, len(routes))
+        best = min(cost for cost, _, _ in results.values())
+        for engine, (cost, elapsed, vehicles) in results.items():
+            rows.append((n, engine, f'{cost:.1f}', f'{cost / best - 1:.2%}', vehicles, f'{elapsed:.1f}'))
+    print_table(('stops', 'engine', 'cost', 'gap to best', 'routes', 'time (s)'), rows)
+
+if __name__ == '__main__':
+    main()
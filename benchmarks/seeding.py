@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+
+import numpy as np
+
+from app.core.engine.cvrp import CVRP, GA_PARAMS
+from .common import random_instance, print_table
+
+def run(coords, matrix, nodes, capacity, ngen, seed_ratio, seed):
+    cvrp = CVRP(capacity, matrix, nodes, seed=seed, coords=coords)
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        cvrp.genetic_algorithm_t(**dict(GA_PARAMS, ngen=ngen, seed_ratio=seed_ratio))
+    return np.array(cvrp.stats['history']), perf_counter() - start
+
+def generations_to(history, target):
+    reached = np.flatnonzero(history <= target)
+    return int(reached[0]) if len(reached) else '-'
+
+def main():
+    parser = ArgumentParser(description="Generations needed to reach a target cost with and without heuristic seeding")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--ngen', type=int, default=60)
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed-ratio', type=float, default=0.1)
+    parser.add_argument('--target-gap', type=float, default=0.02, help="target is this far above the best cost found by either run")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords, matrix, nodes = random_instance(n, args.seed)
+        random_history, random_time = run(coords, matrix, nodes, args.capacity, args.ngen, 0, args.seed)
+        seeded_history, seeded_time = run(coords, matrix, nodes, args.capacity, args.ngen, args.seed_ratio, args.seed)
+        target = min(random_history[-1], seeded_history[-1]) * (1 + args.target_gap)
+        rows.append((n, f'{target:.1f}',
+                     f'{random_history[0]:.1f}', generations_to(random_history, target), f'{random_history[-1]:.1f}', f'{random_time:.1f}',
+                     f'{seeded_history[0]:.1f}', generations_to(seeded_history, target), f'{seeded_history[-1]:.1f}', f'{seeded_time:.1f}'))
+    print_table(('stops', 'target', 'random: initial', 'gens to target', 'final', 'time (s)',
+                 'seeded: initial', 'gens to target', 'final', 'time (s)'), rows)
+
+if __name__ == '__main__':
+    main()
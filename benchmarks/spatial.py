@@ -0,0 +1,69 @@
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+
+from app.core.engine.matrix import SparseMatrix
+from app.core.engine.spatial import GridIndex
+from .common import random_coords, timed, print_table
+
+# A wrongly geocoded address far away from the rest of the stops
+OUTLIER = (51.5072, -0.1276)
+
+def outlier_coords(n, outliers, seed=0):
+    coords = random_coords(n, seed)
+    coords[:outliers] = OUTLIER
+    return coords
+
+def brute_knn_distances(points, rows, k):
+    # Sorted distances of the given points to their k nearest other points
+    distances = np.hypot(*(points[rows, None, :] - points[None, :, :]).transpose(2, 0, 1))
+    distances[np.arange(len(rows)), rows] = np.inf
+    return np.sort(distances, axis=1)[:, :k]
+
+def peak_memory(fn, *args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = ArgumentParser(description="Grid index k-nearest neighbour queries against node count, with and without far "
+                                        "away outliers, checked against a brute force search")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 40000])
+    parser.add_argument('--outliers', type=int, nargs='+', default=[0, 1, 10])
+    parser.add_argument('--k', type=int, default=16)
+    parser.add_argument('--check', type=int, default=500, help="points (the outliers included) checked against brute force")
+    parser.add_argument('--sparse-sizes', type=int, nargs='+', default=[10000, 40000],
+                        help="sizes to also build the sparse matrix storage at, which the automatic choice picks for the largest imports")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        for outliers in args.outliers:
+            coords = outlier_coords(n, outliers)
+            index = GridIndex(coords)
+            seconds, near = timed(index.knn, args.k, repeat=args.repeat)
+            memory = peak_memory(index.knn, args.k)
+            checked = np.unique(np.r_[np.arange(min(outliers, n)), np.linspace(0, n - 1, min(args.check, n)).astype(np.int64)])
+            found = np.hypot(*(index.points[checked, None, :] - index.points[near[checked]]).transpose(2, 0, 1))
+            exact = np.allclose(found, brute_knn_distances(index.points, checked, args.k))
+            rows.append((n, outliers, f'{seconds:.2f}', f'{memory / 2 ** 20:.1f}', 'yes' if exact else 'NO'))
+    print_table(('stops', 'outliers', 'knn (s)', 'peak (MB)', 'exact'), rows)
+
+    # The sparse storage keeps the same neighbour lists, its build should stay O(n * k) in memory with outliers too
+    print()
+    rows = []
+    for n in args.sparse_sizes:
+        for outliers in args.outliers:
+            coords = outlier_coords(n, outliers)
+            seconds, matrix = timed(SparseMatrix, coords)
+            memory = peak_memory(SparseMatrix, coords)
+            rows.append((n, outliers, f'{seconds:.2f}', f'{memory / 2 ** 20:.1f}', f'{matrix.nbytes / 2 ** 20:.1f}'))
+    print_table(('stops', 'outliers', 'build (s)', 'peak (MB)', 'arrays (MB)'), rows)
+
+if __name__ == '__main__':
+    main()
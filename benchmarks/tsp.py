@@ -0,0 +1,41 @@
+from argparse import ArgumentParser
+
+import numpy as np
+
+from app.core.engine.matrix import build_w_matrix
+from app.core.engine.tabu import Tabu
+from app.core.engine.spatial import GridIndex
+from app.core.engine.tsp import NEIGHBOURS, TwoOptTSP
+from .common import random_coords, timed, print_table
+
+def run_tabu(matrix, iterations):
+    depot = (len(matrix) - 1, 0)
+    route = [(i, 0) for i in range(len(matrix) - 1)] + [depot]
+    return Tabu(matrix, depot, seed=0).execute(route, iterations)[1]
+
+def main():
+    parser = ArgumentParser(description="Large TSP engine (2-opt / Or-opt with neighbour lists) against the tabu search")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--tabu-limit', type=int, default=1000, help="largest size to also run the tabu search on")
+    parser.add_argument('--tabu-iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        # float32 keeps the 10k matrix at 400 MB
+        coords = random_coords(n)
+        matrix = build_w_matrix(coords, dtype=np.float32)
+        candidates_time, candidates = timed(lambda: GridIndex(coords).knn(NEIGHBOURS))
+        engine = TwoOptTSP(matrix, candidates=candidates)
+        nn_time, tour = timed(engine.nearest_neighbour_tour, n - 1)
+        engine.tour = tour
+        nn_cost = engine.tour_cost(tour)
+        improve_time, _ = timed(engine.improve)
+        cost = engine.tour_cost(engine.tour)
+        tabu = timed(run_tabu, matrix, args.tabu_iterations) if n <= args.tabu_limit else None
+        rows.append((n, f'{candidates_time:.2f}', f'{nn_time:.2f}', f'{nn_cost:.1f}', f'{improve_time:.2f}', f'{cost:.1f}',
+                     f'{tabu[0]:.2f}' if tabu else '-', f'{tabu[1]:.1f}' if tabu else '-'))
+    print_table(('stops', 'candidates (s)', 'nn tour (s)', 'nn cost', '2-opt/or-opt (s)', 'cost', 'tabu (s)', 'tabu cost'), rows)
+
+if __name__ == '__main__':
+    main()
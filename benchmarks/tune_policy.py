@@ -0,0 +1,140 @@
+import json
+import random
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from glob import glob
+from io import StringIO
+from os.path import join
+
+import numpy as np
+
+from app.core.engine.cvrp import CVRP
+from app.core.engine.matrix import build_w_matrix
+from app.core.engine.policy import DEFAULT_PARAMS, DEFAULT_RULES, ParameterPolicy, instance_features
+from app.core.engine.spatial import GridIndex
+from app.core.engine.tabu import Tabu
+from app.core.engine.tsp import NEIGHBOURS as TSP_NEIGHBOURS
+from .common import random_instance, timed, print_table
+
+# Values the GA parameter settings are sampled from
+SEARCH_SPACE = {
+    'k': [2, 3, 4],
+    'size': [40, 60, 100, 150],
+    'ngen': [60, 120, 200, 300],
+    'ratio_cross': [0.7, 0.85, 0.95],
+    'tabu_iterations': [3, 5, 8],
+}
+TSP_ITERATIONS = [250, 500, 1000, 2000]
+
+def load_instances(directory):
+    # Instances as JSON files with the coordinates (the depot last), the demands of the stops and the vehicle capacity:
+    # {"coords": [[lat, lon], ...], "demands": [...], "max_capacity": 15}
+    instances = []
+    for path in sorted(glob(join(directory, '*.json'))):
+        with open(path) as file:
+            instance = json.load(file)
+        coords = np.array(instance['coords'], dtype=np.float64)
+        nodes = [(i, int(demand), f'Stop {i}') for i, demand in enumerate(instance['demands'])] + [(len(coords) - 1, 'Depot')]
+        instances.append((path, coords, build_w_matrix(coords), nodes, instance['max_capacity']))
+    return instances
+
+def random_instances(sizes, capacities, seed):
+    return [(f'random-{n}-{capacity}', *random_instance(n, seed), capacity) for n in sizes for capacity in capacities]
+
+def intervals(edges, step):
+    # Inclusive [low, high] bounds between consecutive edges, open at both ends
+    bounds = [None] + list(edges) + [None]
+    return [[low if low is None or i == 0 else low + step, high] for i, (low, high) in enumerate(zip(bounds, bounds[1:]))]
+
+def bucket(value, bounds):
+    # The last class the value falls within, as the last matching rule is the one that counts
+    return max(i for i, (low, high) in enumerate(bounds) if (low is None or value >= low) and (high is None or value <= high))
+
+def run_ga(instance, params, time_limit):
+    _, coords, matrix, nodes, capacity = instance
+    cvrp = CVRP(capacity, matrix, nodes, seed=0, coords=coords)
+    with redirect_stdout(StringIO()):
+        elapsed, (best, _) = timed(cvrp.genetic_algorithm_t, **cvrp.ga_params(params), time_limit=time_limit)
+    return float(best[1]), elapsed
+
+def run_tsp(instance, iterations):
+    _, coords, matrix, nodes, _ = instance
+    depot, genes = (len(nodes) - 1, 0), [(i, 0) for i in range(len(nodes) - 1)]
+    tabu = Tabu(matrix, depot, seed=0, candidates=GridIndex(coords).knn(TSP_NEIGHBOURS))
+    return timed(lambda: tabu.execute(genes + [depot], iterations)[1])
+
+def choose(results, default, max_slowdown):
+    # The setting with the lowest mean cost relative to the best one found per instance, among those taking at most
+    # max_slowdown times the default setting's mean time
+    best = np.min([costs for costs, _ in results.values()], axis=0)
+    limit = np.mean(results[default][1]) * max_slowdown
+    allowed = [key for key, (_, times) in results.items() if np.mean(times) <= limit]
+    return min(allowed, key=lambda key: (np.mean(np.array(results[key][0]) / best), np.mean(results[key][1])))
+
+def main():
+    parser = ArgumentParser(description="Offline search of solver parameters per instance class, writing a policy table "
+                                        "for the SOLVER_POLICY environment variable")
+    parser.add_argument('--instances', help="directory of JSON instances, random ones are generated when not given")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 100, 300], help="stops of the random instances")
+    parser.add_argument('--capacities', type=int, nargs='+', default=[8, 15], help="vehicle capacities of the random instances")
+    parser.add_argument('--stop-edges', type=int, nargs='+', default=[50, 200], help="stop counts separating the instance classes")
+    parser.add_argument('--ratio-edges', type=float, nargs='+', default=[0.2],
+                        help="demand to capacity ratios separating the instance classes")
+    parser.add_argument('--trials', type=int, default=8, help="random GA settings tried per class, besides the default one")
+    parser.add_argument('--max-slowdown', type=float, default=1.0, help="time a setting may take relative to the default one")
+    parser.add_argument('--tsp-tolerance', type=float, default=0.005,
+                        help="cost above the best TSP result the fewest iterations may end up at")
+    parser.add_argument('--time-limit', type=float, default=None, help="time limit of a single GA run in seconds")
+    parser.add_argument('--out', default='policy.json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    instances = load_instances(args.instances) if args.instances else random_instances(args.sizes, args.capacities, args.seed)
+    stop_bounds = intervals(args.stop_edges, 1)
+    # Ratio classes overlap at their edges, where the later class' rule wins
+    ratio_bounds = intervals(args.ratio_edges, 0)
+    classes = {}
+    for instance in instances:
+        features = instance_features(instance[3], instance[4])
+        classes.setdefault((bucket(features['stops'], stop_bounds), bucket(features['demand_ratio'], ratio_bounds)), []).append(instance)
+
+    rng = random.Random(args.seed)
+    default = tuple(sorted(DEFAULT_PARAMS['ga'].items()))
+    rules, rows = [], []
+    for (s, r), members in sorted(classes.items()):
+        settings = {default} | {tuple(sorted({name: rng.choice(values) for name, values in SEARCH_SPACE.items()}.items()))
+                                for _ in range(args.trials)}
+        results = {}
+        for setting in settings:
+            runs = [run_ga(instance, dict(setting), args.time_limit) for instance in members]
+            results[setting] = ([cost for cost, _ in runs], [elapsed for _, elapsed in runs])
+        chosen = choose(results, default, args.max_slowdown)
+        overrides = {name: value for name, value in chosen if DEFAULT_PARAMS['ga'][name] != value}
+        if overrides:
+            rules.append({'when': {'stops': stop_bounds[s], 'demand_ratio': ratio_bounds[r]}, 'params': {'ga': overrides}})
+        gain = 1 - np.mean(np.array(results[chosen][0]) / np.array(results[default][0]))
+        rows.append((f'{stop_bounds[s]}', f'{ratio_bounds[r]}', len(members), json.dumps(overrides) if overrides else 'default',
+                     f'{gain:.2%}', f'{np.mean(results[chosen][1]) / np.mean(results[default][1]):.2f}'))
+    print_table(('stops', 'demand ratio', 'instances', 'GA parameters', 'cost gain', 'time vs. default'), rows)
+
+    rows = []
+    for s, bounds in enumerate(stop_bounds):
+        members = [instance for instance in instances if bucket(len(instance[3]) - 1, stop_bounds) == s]
+        if not members:
+            continue
+        runs = {iterations: [run_tsp(instance, iterations) for instance in members] for iterations in TSP_ITERATIONS}
+        best = np.min([[cost for _, cost in results] for results in runs.values()], axis=0)
+        iterations = next(iterations for iterations, results in runs.items()
+                          if (np.array([cost for _, cost in results]) <= best * (1 + args.tsp_tolerance)).all())
+        if iterations != DEFAULT_PARAMS['tsp']['iterations']:
+            rules.append({'when': {'stops': bounds}, 'params': {'tsp': {'iterations': iterations}}})
+        rows.append((f'{bounds}', len(members), iterations, f'''{np.mean([elapsed for elapsed, _ in runs[iterations]]):.2f}'''))
+    print_table(('stops', 'instances', 'TSP iterations', 'time (s)'), rows)
+
+    # Time budget rules aren't tuned here, they are kept as they are
+    rules += [rule for rule in DEFAULT_RULES if 'time_budget' in rule['when']]
+    ParameterPolicy(rules).save(args.out)
+    print(f'Policy with {len(rules)} rules written to {args.out}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+
+import numpy as np
+
+from app.core.engine.matrix import MATRIX_STORAGES, build_matrix, build_w_matrix
+from .common import random_coords, timed, print_table
+
+def loop_w_matrix(coords):
+    # The former prepare_w_matrix implementation, kept for comparison
+    matrix = np.empty((len(coords), len(coords)))
+    for i in range(len(coords)):
+        for j in range(i, len(coords)):
+            matrix[i][j] = np.linalg.norm(coords[i] - coords[j])
+            matrix[j][i] = matrix[i][j]
+    return matrix
+
+def main():
+    parser = ArgumentParser(description="Distance matrix build time against node count")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 250, 500, 1000, 2000, 5000])
+    parser.add_argument('--loop-limit', type=int, default=1000, help="largest size to also time with the Python loop")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords = random_coords(n)
+        loop = f'{timed(loop_w_matrix, coords)[0]:.4f}' if n <= args.loop_limit else '-'
+        euclidean = timed(build_w_matrix, coords, 'euclidean', repeat=args.repeat)[0]
+        haversine = timed(build_w_matrix, coords, 'haversine', repeat=args.repeat)[0]
+        rows.append((n, loop, f'{euclidean:.4f}', f'{haversine:.4f}'))
+    print_table(('nodes', 'loop (s)', 'euclidean (s)', 'haversine (s)'), rows)
+
+    # Build time and resident size of the haversine matrix in every storage (the mapped file is counted at its size)
+    print()
+    rows = []
+    for n in args.sizes:
+        coords = random_coords(n)
+        row = [n]
+        for storage in MATRIX_STORAGES:
+            seconds, matrix = timed(build_matrix, coords, 'haversine', storage, repeat=args.repeat)
+            row += [f'{seconds:.4f}', f'{matrix.nbytes / 2 ** 20:.1f}']
+        rows.append(row)
+    print_table(('nodes', *(f'{storage} {column}' for storage in MATRIX_STORAGES for column in ('(s)', '(MB)'))), rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+
+import numpy as np
+
+from app.core.engine.cvrp import CVRP, GA_PARAMS
+from app.core.engine.matrix import build_w_matrix
+from .common import random_instance, random_coords, timed, print_table
+
+def solution_cost(matrix, routes):
+    return sum(matrix[route[:-1], route[1:]].sum() for route in routes)
+
+def main():
+    parser = ArgumentParser(description="Re-solve after adding stops: warm start from the previous solution vs. a cold GA run")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200])
+    parser.add_argument('--added', type=int, nargs='+', default=[5, 20])
+    parser.add_argument('--capacity', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        coords, matrix, nodes = random_instance(n, args.seed)
+        with redirect_stdout(StringIO()):
+            _, previous = CVRP(args.capacity, matrix, nodes, seed=args.seed, coords=coords).genetic_algorithm_t(**GA_PARAMS)
+        for added in args.added:
+            # The added stops go before the depot, which stays the last node
+            extra = random_coords(added, args.seed + added)
+            new_coords = np.concatenate((coords[:-1], extra, coords[-1:]))
+            new_nodes = nodes[:-1] + [(n + i, 2, f'New stop {i}') for i in range(added)] + [(n + added, 'Depot')]
+            new_matrix = build_w_matrix(new_coords)
+            routes = [[p if p < n else n + added for p in route][1:-1] for route in previous]
+            with redirect_stdout(StringIO()):
+                cold_time, (_, cold) = timed(CVRP(args.capacity, new_matrix, new_nodes, seed=args.seed, coords=new_coords)
+                                             .genetic_algorithm_t, **GA_PARAMS)
+                warm_time, warm = timed(CVRP(args.capacity, new_matrix, new_nodes, seed=args.seed, coords=new_coords)
+                                        .warm_start, routes, list(range(n, n + added)))
+            rows.append((n, added, f'{solution_cost(new_matrix, cold):.1f}', f'{cold_time:.2f}',
+                         f'{solution_cost(new_matrix, warm):.1f}', f'{warm_time:.2f}', f'{warm_time / cold_time:.1%}'))
+    print_table(('stops', 'added', 'cold: cost', 'time (s)', 'warm: cost', 'time (s)', 'warm / cold time'), rows)
+
+if __name__ == '__main__':
+    main()